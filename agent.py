@@ -1,7 +1,9 @@
+import random
 import torch
 import numpy as np
-import random
-import collections
+from replay import ReplayBuffer, PrioritizedReplayBuffer, MappedReplayBuffer, NStepBuffer, FLUSH_EVERY
+from policy import Policy
+from observation import get_spec
 
 '''
 Update 8/10/2025
@@ -10,17 +12,47 @@ Update 8/10/2025
 - Lowered eps_decay rate to 0.995 for a quicker decay as now it updates less often.
 '''
 
+def seed_everything(seed):
+    '''
+    Seeds the global random, numpy and torch generators.
+    '''
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+def build_q_network(n_actions = 8, obs_size = 42):
+    '''
+    Builds the network used both as the q network and the target network.
+    '''
+    return torch.nn.Sequential(
+            torch.nn.Linear(obs_size, 128), #Input layer: the observation, check observation.py for the layouts
+            torch.nn.ReLU(),
+            torch.nn.Dropout(0.2),
+            torch.nn.Linear(128,64),
+            torch.nn.ReLU(),
+            torch.nn.Linear(64, n_actions) #Output layer: 8 possible positions: up, down, left, right, diagonals
+    )
+
 class Agent(torch.nn.Module):
     '''
     Agent based on Deep Q learning.
     '''
-    def __init__(self, n_actions = 8, eps = 1.0, min_eps = 0.05, eps_decay = 0.995, memory_size = 1000):
+    def __init__(self, n_actions = 8, eps = 1.0, min_eps = 0.05, eps_decay = 0.995, memory_size = 100_000, prioritized = False,
+                 compile_policy = None, observation = 'absolute', seed = None, n_step = 1, double_dqn = False, tau = None,
+                 replay_dir = None, replay_dtype = 'float32', learning_rate = 0.0005, gamma = 0.95, batch_size = 32,
+                 target_update_frequency = 100, replay_flush_every = FLUSH_EVERY):
         super(Agent, self).__init__()
 
+        #Observation layout the agent is trained on, see observation.SPECS
+        self.obs_spec = get_spec(observation)
+        obs_size = self.obs_spec.size
+
         self.n_actions = n_actions #Number of possible actions: up, down, left, right, top_left, top_right, down_right, down_left = 8
         self.memory_size = memory_size
         self.step_count = 0
-        self.target_update_frequency = 100  #Update target network every 100 steps
+        self.target_update_frequency = target_update_frequency  #Update target network every 100 steps by default
+        self.tau = tau #With a tau, the target network instead follows the q network a bit after every step (Polyak averaging)
+        self.double_dqn = double_dqn #The q network picks the next action, the target network evaluates it
 
         #Epsilon-Greedy: For exploration(random action) and exploitation(best action)
         self.eps = eps
@@ -28,38 +60,46 @@ class Agent(torch.nn.Module):
         self.eps_decay = eps_decay
 
         #Store past experiences, check the 'remember' function.
-        self.memory = collections.deque(maxlen=self.memory_size)
+        #With prioritized replay, collisions and border hits are sampled more often than the uneventful frames.
+        #With a replay_dir, the memory lives in memory-mapped files there instead, for capacities that don't fit in RAM,
+        #and its counters are flushed every replay_flush_every transitions so readers and a restart see them.
+        self.prioritized = prioritized
+        if replay_dir is not None:
+            if prioritized:
+                raise ValueError("Prioritized replay can't be memory-mapped")
+            self.memory = MappedReplayBuffer(replay_dir, self.memory_size, obs_size, obs_dtype=replay_dtype, seed=seed,
+                                             flush_every=replay_flush_every)
+        elif prioritized:
+            self.memory = PrioritizedReplayBuffer(self.memory_size, obs_size, seed=seed)
+        else:
+            self.memory = ReplayBuffer(self.memory_size, obs_size, seed=seed)
 
         #For Bellman's equation
-        self.gamma = 0.95
+        self.gamma = gamma
+
+        #n-step returns: the experiences are stored with the discounted rewards of the next n_step frames, which carries
+        #the collision penalty back n_step frames per update instead of one
+        self.n_step = n_step
+        self.n_step_buffer = NStepBuffer(n_step, self.gamma) if n_step > 1 else None
 
-        self.batch_size = 32
+        self.batch_size = batch_size
         
-        self.q_network = torch.nn.Sequential(
-                torch.nn.Linear(42, 128), #Input layer: (pos_x, pos_y, positions of maximum 20 enemies...)
-                torch.nn.ReLU(),
-                torch.nn.Dropout(0.2),
-                torch.nn.Linear(128,64),
-                torch.nn.ReLU(),
-                torch.nn.Linear(64, n_actions) #Output layer: 8 possible positions: up, down, left, right, diagonals
-        )
-
-        self.target_network = torch.nn.Sequential(
-                torch.nn.Linear(42, 128), #Input layer: (pos_x, pos_y, positions of maximum 20 enemies...)
-                torch.nn.ReLU(),
-                torch.nn.Dropout(0.2),
-                torch.nn.Linear(128,64),
-                torch.nn.ReLU(),
-                torch.nn.Linear(64, n_actions) #Output layer: 8 possible positions: up, down, left, right, diagonals
-        )
+        self.q_network = build_q_network(n_actions, obs_size)
+
+        self.target_network = build_q_network(n_actions, obs_size)
 
         # Copy weights to target network
         self.target_network.load_state_dict(self.q_network.state_dict())
+        self.parameter_pairs = list(zip(self.target_network.parameters(), self.q_network.parameters()))
 
-        self.learning_rate = 0.0005
+        self.learning_rate = learning_rate
         self.optimizer = torch.optim.Adam(self.parameters(), lr=self.learning_rate)
         self.criterion = torch.nn.MSELoss()
 
+        #Acting goes through this, it shares the q network weights but skips dropout and autograd.
+        #Double DQN also picks the next actions with its model.
+        self.policy = Policy(self.q_network, compile=compile_policy)
+
     def forward(self, x):
         return self.q_network(x)
     
@@ -70,13 +110,19 @@ class Agent(torch.nn.Module):
             action = np.random.randint(self.n_actions)
         else:
             #exploitation
-            with torch.no_grad():
-                q_vals = self.q_network(torch.tensor(state).unsqueeze(0).float())
-                action = torch.argmax(q_vals).item()
+            action = self.policy.act(state)
 
-        #eps decay
-        
         return action
+
+    def select_actions(self, states):
+        '''
+        Epsilon-Greedy for a batch of states (one per game), with a single forward pass.
+        '''
+        n = len(states)
+        actions = self.policy.act_batch(states).copy()
+        explore = np.random.rand(n) < self.eps
+        actions[explore] = np.random.randint(self.n_actions, size=int(explore.sum()))
+        return actions
     
     def decay_epsilon(self):
         if self.eps > self.min_eps:
@@ -87,40 +133,72 @@ class Agent(torch.nn.Module):
     # For this last idea, we need a way to store the experiences and include them (maybe not all) in the training loop. 
 
     def remember(self, state, action, reward, next_state, done):
-        self.memory.append((state, action, reward, next_state, done))
+        if self.n_step_buffer is None:
+            self.memory.add(state, action, reward, next_state, done)
+            return
+        for transition in self.n_step_buffer.add(state, action, reward, next_state, done):
+            self.memory.add(*transition)
 
     def replay(self): #Usage of memories to train. 
         if len(self.memory) < self.batch_size: 
             return None
         #Not enough experiences gained, just keep moving
 
-        batch = random.sample(self.memory, self.batch_size)
-        states, actions, rewards, next_states, dones = zip(*batch)
+        batch = self.memory.sample(self.batch_size)
+        loss, td_errors = self.learn(batch)
+        if self.prioritized:
+            self.memory.update_priorities(batch[-1], td_errors)
+        return loss
 
-        states = torch.from_numpy(np.array(states)).float()
-        actions = torch.tensor(actions).int()
-        rewards = torch.tensor(rewards).float()
-        next_states = torch.from_numpy(np.array(next_states)).float()
-        dones = torch.tensor(dones).float()
+    def learn(self, batch):
+        '''
+        One gradient step on a batch sampled from the memory. Returns the loss and the TD errors of the batch.
+        '''
+        states, actions, rewards, next_states, dones = batch[:5]
+        dones = dones.float()
 
         q_vals = self.q_network(states)
 
         with torch.no_grad():
             next_q_vals = self.target_network(next_states)
-            max_next_q = torch.max(next_q_vals, dim=1)[0]
-        target_q = rewards + (self.gamma * max_next_q * (1 - dones))
-
-        q_vals_for_actions = q_vals.gather(1, actions.long().unsqueeze(1)).squeeze()
-        loss = self.criterion(q_vals_for_actions, target_q)
+            if self.double_dqn:
+                next_actions = self.policy.model(next_states).argmax(dim=1, keepdim=True)
+                max_next_q = next_q_vals.gather(1, next_actions).squeeze(1)
+            else:
+                max_next_q = torch.max(next_q_vals, dim=1)[0]
+        #The rewards already hold n_step discounted frames, so the bootstrap is n_step frames away
+        target_q = rewards + (self.gamma ** self.n_step * max_next_q * (1 - dones))
+
+        q_vals_for_actions = q_vals.gather(1, actions.long().unsqueeze(1)).squeeze(1)
+        td_errors = q_vals_for_actions - target_q
+        if self.prioritized:
+            #Importance-sampling weights undo the bias of sampling by priority
+            weights = batch[5]
+            loss = (weights * td_errors ** 2).mean()
+        else:
+            loss = self.criterion(q_vals_for_actions, target_q)
 
         self.optimizer.zero_grad()
         loss.backward()
         self.optimizer.step()
 
         self.step_count += 1
-        if self.step_count > self.target_update_frequency:
-            self.target_network.load_state_dict(self.q_network.state_dict())
+        if self.tau is not None:
+            self.update_target(self.tau)
+        elif self.step_count > self.target_update_frequency:
+            self.update_target()
             self.step_count = 0
 
-        return loss.item()
+        return loss.item(), td_errors.detach().numpy()
+
+    @torch.no_grad()
+    def update_target(self, tau = 1.0):
+        '''
+        Moves the target network weights towards the q network ones, in place: tau = 1 copies them.
+        '''
+        for target, online in self.parameter_pairs:
+            if tau == 1.0:
+                target.copy_(online)
+            else:
+                target.lerp_(online, tau)
 
@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import numpy as np
+import torch
+from agent import seed_everything
+
+'''
+Benchmarks for the hot paths: environment stepping, replay, action selection and end-to-end training,
+plus the startup time of the game.
+Everything runs with fixed seeds and the results are written as JSON, which can be compared against a stored
+baseline to catch slowdowns:
+
+    python bench.py --output results.json --baseline bench_baseline.json
+
+Benchmarks the baseline has no value for fail the comparison as well, so store a new baseline (--update-baseline)
+along with every new benchmark.
+'''
+
+SEED = 0
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+DEFAULT_THRESHOLD = 0.25 #Allowed slowdown against the baseline, as a fraction
+
+
+def measure(fn, iterations, repeats = 5):
+    '''
+    Calls fn iterations times, repeats times over, and returns the best seconds per call (like timeit, the minimum is the least noisy).
+    '''
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        timings.append((time.perf_counter() - start) / iterations)
+    return min(timings)
+
+
+def result(value, unit, higher_is_better):
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+#########################################################################################################
+##########################          Benchmarks          #################################################
+#########################################################################################################
+def bench_env(quick):
+    from game import env_reset, advance
+
+    seed_everything(SEED)
+    results = {}
+    n_frames = 2000 if quick else 20000
+    player, enemies, n_enemies, frames_passed, state, reward, done = env_reset()
+    rng = np.random.default_rng(SEED)
+    actions = rng.integers(0, 8, n_frames)
+
+    start = time.perf_counter()
+    for action in actions:
+        state, reward, done, frames_passed = advance(player, int(action), enemies, n_enemies, frames_passed)
+        if done:
+            player, enemies, n_enemies, frames_passed, state, reward, done = env_reset()
+    results['env.step'] = result(n_frames / (time.perf_counter() - start), 'steps/s', True)
+
+    from observation import SPECS
+    random.seed(SEED)
+    encoder = SPECS['ego'].encoder()
+    player, enemies, n_enemies, frames_passed, state, reward, done = env_reset(encoder=encoder)
+    start = time.perf_counter()
+    for action in actions:
+        state, reward, done, frames_passed = advance(player, int(action), enemies, n_enemies, frames_passed, encoder=encoder)
+        if done:
+            player, enemies, n_enemies, frames_passed, state, reward, done = env_reset(encoder=encoder)
+    results['env.step[obs=ego]'] = result(n_frames / (time.perf_counter() - start), 'steps/s', True)
+
+    results['env.reset'] = result(1.0 / measure(env_reset, 1000 if quick else 10000), 'resets/s', True)
+
+    from vec_env import VecEnv
+    for n_envs in (64, 1024):
+        env = VecEnv(n_envs, seed=SEED)
+        env.reset()
+        batch = rng.integers(0, 8, n_envs)
+        per_call = measure(lambda: env.step(batch), 50 if quick else 500)
+        results[f'vec_env.step[n={n_envs}]'] = result(n_envs / per_call, 'steps/s', True)
+    return results
+
+
+def bench_replay(quick):
+    from agent import Agent
+
+    results = {}
+    buffer_sizes = (10_000,) if quick else (10_000, 100_000, 1_000_000)
+    for buffer_size in buffer_sizes:
+        for batch_size in (32, 128, 512):
+            seed_everything(SEED)
+            agent = Agent(memory_size=buffer_size)
+            agent.batch_size = batch_size
+            rng = np.random.default_rng(SEED)
+            states = rng.random((buffer_size, 42), dtype=np.float32)
+            agent.memory.add_batch(states, rng.integers(0, 8, buffer_size), rng.random(buffer_size),
+                                   np.roll(states, -1, axis=0), rng.random(buffer_size) < 0.01)
+            per_call = measure(agent.replay, 20 if quick else 200)
+            results[f'agent.replay[buffer={buffer_size},batch={batch_size}]'] = result(per_call * 1e6, 'us', False)
+    return results
+
+
+def bench_select_action(quick):
+    from agent import Agent
+
+    seed_everything(SEED)
+    agent = Agent()
+    state = np.random.default_rng(SEED).random(42)
+    iterations = 1000 if quick else 10000
+    results = {}
+    agent.eps = 0.0
+    results['agent.select_action[greedy]'] = result(measure(lambda: agent.select_action(state), iterations) * 1e6, 'us', False)
+    agent.eps = 1.0
+    results['agent.select_action[random]'] = result(measure(lambda: agent.select_action(state), iterations) * 1e6, 'us', False)
+
+    agent.eps = 0.0
+    for n_states in (64, 1024):
+        states = np.random.default_rng(SEED).random((n_states, 42), dtype=np.float32)
+        per_call = measure(lambda: agent.select_actions(states), iterations // 10)
+        results[f'agent.select_actions[n={n_states}]'] = result(n_states / per_call, 'states/s', True)
+    return results
+
+
+def bench_training(quick):
+    from agent import Agent
+    from train import agent_training_loop
+
+    class CountingAgent(Agent):
+        '''
+        Counts the decisions taken, one per simulated frame.
+        '''
+        def __init__(self):
+            super(CountingAgent, self).__init__()
+            self.frames = 0
+
+        def select_action(self, state):
+            self.frames += 1
+            return super(CountingAgent, self).select_action(state)
+
+    n_episodes = 2 if quick else 10
+    results = {}
+
+    seed_everything(SEED)
+    agent = CountingAgent()
+    start = time.perf_counter()
+    agent_training_loop(n_episodes=n_episodes, agent=agent)
+    results['train.frames[render=off]'] = result(agent.frames / (time.perf_counter() - start), 'frames/s', True)
+
+    try:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import pygame
+    except ImportError:
+        return results
+
+    from debug import ScrollingText
+    from game import SCREEN_WIDTH, SCREEN_HEIGHT
+    from render import TrainingRenderer
+
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    renderer = TrainingRenderer(screen, pygame.time.Clock(), pygame.font.Font(None, 25),
+                                ScrollingText(pygame.font.Font(None, 40), screen), 0) #fps 0 means uncapped
+    seed_everything(SEED)
+    agent = CountingAgent()
+    start = time.perf_counter()
+    agent_training_loop(n_episodes=n_episodes, render_episode=1, renderer=renderer, agent=agent)
+    results['train.frames[render=on]'] = result(agent.frames / (time.perf_counter() - start), 'frames/s', True)
+    pygame.quit()
+    return results
+
+
+STARTUP_SCRIPTS = {
+    'startup.python': 'pass', #Interpreter startup alone, the floor of the others
+    'startup.import_main': 'import main',
+    'startup.menu': 'import main; main.init_display(); '
+                    'main.screen.blit(main.bake_main_menu(main.PLAY_BUTTON, main.TRAIN_BUTTON, main.EXIT_BUTTON), (0, 0)); '
+                    'main.pygame.display.flip()',
+}
+
+
+def bench_startup(quick):
+    '''
+    Cold start of the game in fresh interpreters: importing main, and up to the first main menu frame,
+    on a dummy display so it runs headless.
+    '''
+    try:
+        import pygame
+    except ImportError:
+        return {}
+
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy', PYGAME_HIDE_SUPPORT_PROMPT='1')
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    repeats = 3 if quick else 10
+    results = {}
+    for name, script in STARTUP_SCRIPTS.items():
+        seconds = measure(lambda: subprocess.run([sys.executable, '-c', script], env=env, cwd=cwd, check=True), 1, repeats)
+        results[name] = result(seconds, 's', False)
+    return results
+
+
+BENCHMARKS = {
+    'env': bench_env,
+    'replay': bench_replay,
+    'select_action': bench_select_action,
+    'training': bench_training,
+    'startup': bench_startup,
+}
+
+
+#########################################################################################################
+##########################          Reporting          ##################################################
+#########################################################################################################
+def run(names, quick = False):
+    torch.set_num_threads(1) #Keeps the numbers comparable between machines with different core counts
+    results = {}
+    for name in names:
+        results.update(BENCHMARKS[name](quick))
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'torch': torch.__version__,
+            'machine': platform.machine(),
+            'quick': quick,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, threshold = DEFAULT_THRESHOLD):
+    '''
+    Returns the benchmarks that got slower than the baseline by more than threshold, as (name, baseline, current, change).
+    change is the relative slowdown, so 0.3 means 30% worse whatever the direction of the metric is.
+    '''
+    regressions = []
+    for name, current in report['results'].items():
+        base = baseline['results'].get(name)
+        if base is None or base['value'] == 0:
+            continue
+        if current['higher_is_better']:
+            change = (base['value'] - current['value']) / base['value']
+        else:
+            change = (current['value'] - base['value']) / base['value']
+        if change > threshold:
+            regressions.append((name, base['value'], current['value'], change))
+    return regressions
+
+
+def missing(report, baseline):
+    '''
+    Returns the benchmarks of report that the baseline has no value for, so they can't be checked for regressions.
+    '''
+    return [name for name in report['results'] if name not in baseline['results']]
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Benchmark the environment, replay and inference hot paths.')
+    parser.add_argument('benchmarks', nargs='*', help=f"Benchmarks to run, out of {', '.join(BENCHMARKS)}. All of them by default.")
+    parser.add_argument('--quick', action='store_true', help='Fewer iterations, for a quick check.')
+    parser.add_argument('--output', help='Where to write the JSON report, stdout by default.')
+    parser.add_argument('--baseline', default=None, help='Baseline report to compare against.')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Allowed relative slowdown.')
+    parser.add_argument('--update-baseline', action='store_true', help=f'Store this run as the new baseline ({BASELINE_PATH}).')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    report = run(args.benchmarks or list(BENCHMARKS), args.quick)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            f.write(text + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('quick') != report['meta']['quick']:
+            print("Warning: comparing a --quick run against a full baseline (or the other way round), expect noise.", file=sys.stderr)
+        regressions = compare(report, baseline, args.threshold)
+        for name, base, current, change in regressions:
+            print(f"REGRESSION {name}: {base:.4g} -> {current:.4g} ({change:+.0%})", file=sys.stderr)
+        unchecked = missing(report, baseline)
+        for name in unchecked:
+            print(f"MISSING {name}: not in the baseline, store a new one with --update-baseline", file=sys.stderr)
+        if regressions or unchecked:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import os
+import random
+import numpy as np
+import torch
+
+'''
+Training checkpoints, so long runs can survive a restart.
+A checkpoint holds everything needed to continue from the exact episode it was taken at: both networks, the optimizer,
+the epsilon schedule, the replay memory contents and the random number generators.
+'''
+
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(path, agent, episode, eps_losses, eps_rewards, include_memory = True, counters = None):
+    '''
+    Writes the checkpoint atomically: it goes to a temporary file first, which then replaces path,
+    so a crash while saving never leaves a truncated checkpoint behind.
+    counters is a dict of extra progress counters of the training loop (e.g. steps), given back by load_checkpoint.
+    '''
+    state = {
+        'version': CHECKPOINT_VERSION,
+        'observation': agent.obs_spec.as_dict(),
+        'episode': episode, #Last finished episode
+        'eps_losses': list(eps_losses),
+        'eps_rewards': list(eps_rewards),
+        'networks': agent.state_dict(),
+        'optimizer': agent.optimizer.state_dict(),
+        'eps': agent.eps,
+        'min_eps': agent.min_eps,
+        'eps_decay': agent.eps_decay,
+        'step_count': agent.step_count,
+        'counters': dict(counters or {}),
+        'memory': agent.memory.state_dict() if include_memory else None,
+        'rng': {
+            'python': random.getstate(),
+            'numpy': np.random.get_state(),
+            'torch': torch.get_rng_state(),
+        },
+    }
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, agent, counters = None):
+    '''
+    Restores agent (built with the same settings as the saved one) from the checkpoint at path.
+    Returns (episode, eps_losses, eps_rewards), training continues at episode + 1.
+    The saved counters, if any, are put into the counters dict when one is passed.
+    '''
+    #The checkpoint holds numpy arrays and RNG states besides tensors, so the full unpickler is needed
+    state = torch.load(path, weights_only=False)
+    if state['version'] != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {state['version']} in {path}")
+    #Checkpoints from before the observation layouts were versioned all used the absolute one
+    observation = state.get('observation', {'name': 'absolute', 'version': 1})
+    if (observation['name'], observation['version']) != (agent.obs_spec.name, agent.obs_spec.version):
+        raise ValueError(f"{path} was trained on the {observation['name']} v{observation['version']} observation, "
+                         f"the agent uses {agent.obs_spec.name} v{agent.obs_spec.version}")
+
+    agent.load_state_dict(state['networks'])
+    agent.optimizer.load_state_dict(state['optimizer'])
+    agent.eps = state['eps']
+    agent.min_eps = state['min_eps']
+    agent.eps_decay = state['eps_decay']
+    agent.step_count = state['step_count']
+    if counters is not None:
+        counters.update(state.get('counters', {}))
+    if state['memory'] is not None:
+        agent.memory.load_state_dict(state['memory'])
+
+    random.setstate(state['rng']['python'])
+    np.random.set_state(state['rng']['numpy'])
+    torch.set_rng_state(state['rng']['torch'])
+
+    return state['episode'], state['eps_losses'], state['eps_rewards']
+
+
+def load_q_network(path):
+    '''
+    Builds the q network stored in the checkpoint at path, without the rest of the agent, for acting only.
+    Returns (network, observation layout name).
+    '''
+    from agent import build_q_network
+    from observation import get_spec
+
+    state = torch.load(path, weights_only=False)
+    if state['version'] != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {state['version']} in {path}")
+    observation = state.get('observation', {'name': 'absolute'})['name']
+    weights = {key[len('q_network.'):]: value for key, value in state['networks'].items() if key.startswith('q_network.')}
+    n_actions = weights[max((key for key in weights if key.endswith('.weight')), key=lambda key: int(key.split('.')[0]))].shape[0]
+    network = build_q_network(n_actions, get_spec(observation).size)
+    network.load_state_dict(weights)
+    return network, observation
@@ -1,5 +1,5 @@
 from collections import deque
-import pygame
+from text_cache import render_text
 
 '''
 Update 8/10/2025
@@ -34,23 +34,36 @@ class ScrollingText:
 
     def render(self):
         '''
-        Render and show.
+        Render and show. Returns the rects that were drawn.
         '''
+        rects = []
         for i, text in enumerate(self.text_lines):
             y_position = self.margin_top + (i * self.line_height)
-            text_surface = self.font.render(text, True, TEXT_COLOR)
-            self.screen.blit(text_surface, (self.margin_left, y_position))
+            text_surface = render_text(self.font, text, TEXT_COLOR)
+            rects.append(self.screen.blit(text_surface, (self.margin_left, y_position)))
+        return rects
 
-def draw_debug_stats(screen, font, stats, screen_width, screen_height):
+def draw_debug_stats(screen, font, metrics, screen_width, screen_height):
     '''
     Shows some stats about the training loop on the right side of the screen.
+    The lines are the ones registered with metrics.show(), read from the same store the training loop records to.
+    Returns the rects that were drawn.
     '''
+    return draw_stat_lines(screen, font, metrics.hud_items(), screen_width, screen_height)
+
+def draw_stat_lines(screen, font, items, screen_width, screen_height):
+    '''
+    Draws (label, value) lines on the right side of the screen, for stats that don't come from a live Metrics.
+    Returns the rects that were drawn.
+    '''
+    rects = []
     start_y = screen_height - 120  # Starting y-position for the text
-    for i, (key, value) in enumerate(stats.items()):
+    for i, (key, value) in enumerate(items):
         text = f"{key}: {value}"
-        text_surface = font.render(text, True, (255, 255, 255))
+        text_surface = render_text(font, text, (255, 255, 255))
         
         # Position text at the bottom right
         text_rect = text_surface.get_rect(bottomright=(screen_width - 20, start_y + i * 25))
 
-        screen.blit(text_surface, text_rect)
\ No newline at end of file
+        rects.append(screen.blit(text_surface, text_rect))
+    return rects
@@ -0,0 +1,148 @@
+import sys
+import time
+import json
+import multiprocessing as mp
+import numpy as np
+import torch
+from agent import build_q_network
+from policy import Policy
+from vec_env import VecEnv
+from checkpoint import load_q_network
+
+'''
+Greedy evaluation of a trained agent.
+The games are split in chunks of seeded vectorized games, spread over a process pool, and played with epsilon = 0
+until every game of the chunk has finished once. The same checkpoint, seed and game count always give the same
+report, whatever the number of workers.
+
+    python evaluate.py checkpoint.pt --games 4096 --workers 8
+'''
+
+CHUNK_SIZE = 256 #Games played together by one VecEnv
+MAX_STEPS = 20_000 #Games still alive after this many frames are cut short and counted as survived
+
+
+def play_chunk(flat_weights, n_actions, observation, n_games, seed, max_steps, n_enemies):
+    '''
+    Plays n_games greedy games and returns the stats of every game's first episode.
+    Runs in the pool workers, so everything it needs comes in as plain arguments.
+    '''
+    torch.set_num_threads(1)
+    env = VecEnv(n_games, n_enemies, seed=seed, observation=observation, max_steps=max_steps)
+    network = build_q_network(n_actions, env.obs_size)
+    torch.nn.utils.vector_to_parameters(torch.from_numpy(flat_weights), network.parameters())
+    policy = Policy(network, max_batch=n_games)
+
+    finished = np.zeros(n_games, dtype=bool)
+    stats = {key: np.zeros(n_games, dtype=np.int64) for key in ('length', 'hits', 'border_frames')}
+    stats['truncated'] = np.zeros(n_games, dtype=bool)
+    state = env.reset()
+    steps = 0
+    while not finished.all():
+        state, rewards, dones = env.step(policy.act_batch(state))
+        steps += n_games
+        first = dones & ~finished
+        if first.any():
+            stats['length'][first] = env.last_episode_length[first]
+            stats['hits'][first] = env.last_episode_hits[first]
+            stats['border_frames'][first] = env.last_episode_border_frames[first]
+            stats['truncated'][first] = env.truncated[first]
+            finished |= first
+    stats['steps'] = steps #Includes the frames of games that had already finished, it's what the throughput is about
+    return stats
+
+
+def evaluate(network, observation = 'absolute', n_games = 1000, n_workers = 4, seed = 0, max_steps = MAX_STEPS,
+             n_enemies = 20, chunk_size = CHUNK_SIZE):
+    '''
+    Plays n_games greedy games with network and returns a report dict.
+    n_workers = 0 plays everything in this process.
+    '''
+    flat = torch.nn.utils.parameters_to_vector(network.parameters()).detach().numpy().astype(np.float32)
+    n_actions = network[-1].out_features
+    chunks = [(flat, n_actions, observation, min(chunk_size, n_games - start), seed + i, max_steps, n_enemies)
+              for i, start in enumerate(range(0, n_games, chunk_size))]
+
+    start = time.perf_counter()
+    if n_workers > 0:
+        n_workers = min(n_workers, len(chunks))
+        with mp.get_context('spawn').Pool(n_workers) as pool:
+            pool.map(abs, range(n_workers)) #Waits for the workers to be up, so the startup isn't counted as playing time
+            startup = time.perf_counter() - start
+            start = time.perf_counter()
+            results = pool.starmap(play_chunk, chunks)
+    else:
+        startup = 0.0
+        results = [play_chunk(*chunk) for chunk in chunks]
+    elapsed = time.perf_counter() - start
+
+    length = np.concatenate([r['length'] for r in results])
+    hits = np.concatenate([r['hits'] for r in results])
+    border_frames = np.concatenate([r['border_frames'] for r in results])
+    truncated = np.concatenate([r['truncated'] for r in results])
+    frames = int(length.sum())
+    return {
+        'games': int(n_games),
+        'seed': seed,
+        'max_steps': max_steps,
+        'survival_frames': {
+            'mean': float(length.mean()),
+            'std': float(length.std()),
+            'min': int(length.min()),
+            'p10': float(np.percentile(length, 10)),
+            'p50': float(np.percentile(length, 50)),
+            'p90': float(np.percentile(length, 90)),
+            'max': int(length.max()),
+        },
+        'truncated_rate': float(truncated.mean()), #Games that survived max_steps frames
+        'collisions_per_game': float(hits.mean()),
+        'collisions_per_1000_frames': 1000.0 * hits.sum() / frames,
+        'border_hit_rate': float(border_frames.sum() / frames), #Fraction of frames spent touching a border
+        'seconds': elapsed,
+        'startup_seconds': startup,
+        'games_per_second': n_games / elapsed,
+        'frames_per_second': sum(r['steps'] for r in results) / elapsed,
+    }
+
+
+def print_report(report):
+    survival = report['survival_frames']
+    print(f"{report['games']} games, seed {report['seed']}")
+    print(f"Survival frames: mean {survival['mean']:.1f} (std {survival['std']:.1f}), "
+          f"p10 {survival['p10']:.0f}, p50 {survival['p50']:.0f}, p90 {survival['p90']:.0f}, "
+          f"min {survival['min']}, max {survival['max']}")
+    print(f"Survived all {report['max_steps']} frames: {report['truncated_rate']:.1%}")
+    print(f"Collisions: {report['collisions_per_game']:.3f} per game, {report['collisions_per_1000_frames']:.2f} per 1000 frames")
+    print(f"Border hit rate: {report['border_hit_rate']:.1%} of frames")
+    print(f"Throughput: {report['games_per_second']:.0f} games/s, {report['frames_per_second']:.0f} frames/s "
+          f"({report['seconds']:.2f}s, plus {report['startup_seconds']:.2f}s starting the workers)")
+
+
+def main(argv = None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Evaluate a trained agent greedily on many headless games.')
+    parser.add_argument('checkpoint', help='Checkpoint written by train.py --checkpoint.')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4, help='Worker processes, 0 plays in this process.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-steps', type=int, default=MAX_STEPS, help='Frames after which a game counts as survived.')
+    parser.add_argument('--output', help='Also write the report to this JSON file.')
+    parser.add_argument('--min-survival', type=float, default=None,
+                        help='Exit with an error when the median survival is below this many frames, for promotion gates.')
+    args = parser.parse_args(argv)
+
+    network, observation = load_q_network(args.checkpoint)
+    report = evaluate(network, observation, args.games, args.workers, args.seed, args.max_steps)
+    report['checkpoint'] = args.checkpoint
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.min_survival is not None and report['survival_frames']['p50'] < args.min_survival:
+        print(f"FAILED: median survival {report['survival_frames']['p50']:.0f} < {args.min_survival:.0f}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,563 @@
+import math
+import random
+import numpy as np
+
+'''
+Headless game core shared by the playable game and the agent training loop.
+Nothing in here touches pygame, so it can run on machines without a display.
+Drawing lives in render.py.
+'''
+
+SCREEN_WIDTH = 1280
+SCREEN_HEIGHT = 720
+MAX_ENEMIES = 20 #Enemy cap of the standard game, high-density variants can raise it
+OBS_ENEMIES = 20 #Enemies included in the observation, which keeps it 42 wide whatever the cap is
+OBS_SIZE = 2 + 2 * OBS_ENEMIES
+TICK_RATE = 120 #Logical frames per second, the speeds below are per logical frame
+DT = 1.0 / TICK_RATE
+ENEMY_SPD = 10
+SPAWN_FRAMES = 60 #Logical frames between two enemy spawns
+#Reward shaping, check step(). sweep.py can change them for its trials
+BORDER_PENALTY = 50 #Per frame spent touching a border
+HIT_PENALTY = 100 #Per collision
+DISTANCE_REWARD = 0.01 #Per pixel between the player and the closest enemy, per frame
+
+
+class Rect:
+    '''
+    Minimal axis-aligned rectangle with the same collision rules as pygame.Rect.
+    '''
+    __slots__ = ('x', 'y', 'width', 'height')
+
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    @property
+    def topleft(self):
+        return (self.x, self.y)
+
+    @property
+    def center(self):
+        return (self.x + self.width // 2, self.y + self.height // 2)
+
+    @center.setter
+    def center(self, pos):
+        self.set_center(pos[0], pos[1])
+
+    def set_center(self, x, y):
+        '''
+        Same as setting center, without building a tuple, for the per-frame moves.
+        '''
+        self.x = x - self.width // 2
+        self.y = y - self.height // 2
+
+    @property
+    def centerx(self):
+        return self.x + self.width // 2
+
+    @property
+    def centery(self):
+        return self.y + self.height // 2
+
+    def colliderect(self, other):
+        '''
+        True if both rectangles overlap, touching edges do not count.
+        '''
+        return (self.x < other.x + other.width and self.y < other.y + other.height and
+                self.x + self.width > other.x and self.y + self.height > other.y)
+
+    def inflate(self, dx, dy):
+        '''
+        New rect grown by dx on the left and right and dy on the top and bottom.
+        '''
+        return Rect(self.x - dx, self.y - dy, self.width + 2 * dx, self.height + 2 * dy)
+
+    def as_tuple(self):
+        '''
+        (x, y, width, height), which is what pygame.draw.rect expects.
+        '''
+        return (self.x, self.y, self.width, self.height)
+
+
+def segment_hits_box(x0, y0, x1, y1, left, top, right, bottom):
+    '''
+    Whether the segment (x0, y0) -> (x1, y1) crosses the inside of the box, using the slab method.
+    '''
+    t0, t1 = 0.0, 1.0
+    for p, d, lo, hi in ((x0, x1 - x0, left, right), (y0, y1 - y0, top, bottom)):
+        if d == 0:
+            if p <= lo or p >= hi:
+                return False
+        else:
+            ta = (lo - p) / d
+            tb = (hi - p) / d
+            if ta > tb:
+                ta, tb = tb, ta
+            t0 = max(t0, ta)
+            t1 = min(t1, tb)
+            if t0 >= t1:
+                return False
+    return True
+
+
+screen_rect = Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+top_edge_rect = Rect(0, 0, SCREEN_WIDTH, 1)
+down_edge_rect = Rect(0, SCREEN_HEIGHT, SCREEN_WIDTH, 1)
+left_edge_rect = Rect(0, 0, 1, SCREEN_HEIGHT)
+right_edge_rect = Rect(SCREEN_WIDTH, 0, 1, SCREEN_HEIGHT)
+
+
+class Player:
+    '''
+    Player Class, which is also used for the RL agent.
+    '''
+    __slots__ = ('rect', 'x', 'y', 'spd', 'dest_x', 'dest_y', 'height', 'width', 'hp')
+
+    def __init__(self):
+        self.rect = Rect(640, 360, 60, 60)
+        self.x = 640.0
+        self.y = 360.0
+        self.spd = 15
+        self.dest_x = self.x
+        self.dest_y = self.y
+        self.height = self.rect.height
+        self.width = self.rect.width
+
+        self.hp = 1 #Lowering the hp to 1 might help the agent to learn to dodge more effectively, as it will be a dodge or die situation
+
+    @property
+    def pos(self):
+        return (self.x, self.y)
+
+    @pos.setter
+    def pos(self, pos):
+        self.x = float(pos[0])
+        self.y = float(pos[1])
+
+    @property
+    def dest(self):
+        return (self.dest_x, self.dest_y)
+
+    def set_dest(self, pos):
+        '''
+        Sets the destination to pos.
+        '''
+        self.dest_x = max(self.width//2 , min(pos[0], SCREEN_WIDTH - self.width//2))
+        self.dest_y = max(self.height//2, min(pos[1], SCREEN_HEIGHT - self.height//2))
+
+    def check_edge(self):
+        '''
+        Checks whether the player square is touching a border.
+        '''
+        return self.collision(top_edge_rect) or self.collision(down_edge_rect) or self.collision(left_edge_rect) or self.collision(right_edge_rect)
+
+    def move(self, frames = 1):
+        '''
+        Move the player square to the destination stored in self.dest, covering frames logical frames at once.
+        '''
+        dx = self.dest_x - self.x
+        dy = self.dest_y - self.y
+        move_length = math.hypot(dx, dy)
+        spd = self.spd * frames
+
+        if move_length < spd:
+            self.x = self.dest_x
+            self.y = self.dest_y
+
+        elif move_length != 0:
+            self.x += dx / move_length * spd
+            self.y += dy / move_length * spd
+
+        self.rect.set_center(int(self.x), int(self.y))
+
+    def collision(self, rect):
+        '''
+        Collision detection.
+        '''
+        return self.rect.colliderect(rect)
+
+
+class Enemy:
+    '''
+    Enemy class
+    '''
+    __slots__ = ('code', 'spd', 'rect', 'x', 'y', 'dir_x', 'dir_y', 'slot')
+
+    def __init__(self, rng = None):
+        self.spd = ENEMY_SPD
+        self.rect = Rect(0, 0, 20, 20)
+        self.slot = -1 #Index in the EnemyPool it is alive in, -1 when it isn't
+        self.reset(rng)
+
+    def reset(self, rng = None):
+        '''
+        Re-spawns the enemy in place on a random screen edge, so a pool can reuse it.
+        '''
+        if rng is None: #Seeded games pass their own random.Random, the global one is used otherwise
+            rng = random
+        self.code = rng.randint(0,1)
+
+        #Both candidate edges are drawn before picking one, the seeded games rely on that order
+        if self.code == 0:
+            left_y, right_y = rng.randint(0, 720), rng.randint(0, 720)
+            x, y = rng.choice(((0, left_y), (1280, right_y)))
+
+        else:
+            top_x, bottom_x = rng.randint(0, 1280), rng.randint(0, 1280)
+            x, y = rng.choice(((top_x, 0), (bottom_x, 720)))
+
+        self.rect.x = x
+        self.rect.y = y
+        self.x = float(x)
+        self.y = float(y)
+        self.dir_x = 0.0
+        self.dir_y = 0.0
+
+    @property
+    def pos(self):
+        return (self.x, self.y)
+
+    def set_target(self, pos):
+        '''
+        Sets the position pos as the target, which determines the vector along which the enemy will travel.
+        '''
+        dx = pos[0] - self.x
+        dy = pos[1] - self.y
+        length = math.hypot(dx, dy)
+        self.dir_x = dx / length
+        self.dir_y = dy / length
+
+    def move(self, frames = 1):
+        '''
+        Moves the enemy along the direction established by using self.set_target, covering frames logical frames at once.
+        '''
+        self.x += self.dir_x * self.spd * frames
+        self.y += self.dir_y * self.spd * frames
+        self.rect.set_center(int(self.x), int(self.y))
+
+    def sweeps(self, rect, frames = 1, rect_dx = 0, rect_dy = 0):
+        '''
+        Swept collision test: whether the enemy would run into rect anywhere along its next move, rect being where the
+        target starts and (rect_dx, rect_dy) how far it moves during the same step. The test runs in the target's frame,
+        on the enemy's displacement minus the target's one.
+        Stops fast enemies from tunneling through the player when a step covers several frames.
+        '''
+        dist = self.spd * frames
+        half_w = self.rect.width / 2
+        half_h = self.rect.height / 2
+        return segment_hits_box(self.x, self.y, self.x + self.dir_x * dist - rect_dx, self.y + self.dir_y * dist - rect_dy,
+                                rect.x - half_w, rect.y - half_h, rect.x + rect.width + half_w, rect.y + rect.height + half_h)
+
+    def out_of_screen(self):
+        '''
+        Checks whether the enemy square is outside the screen.
+        '''
+        return not self.rect.colliderect(screen_rect)
+
+
+class EnemyPool:
+    '''
+    Fixed-capacity storage for the enemies of a game. Spawning takes an enemy from the free list and re-initializes it
+    in place, only creating one while the pool hasn't reached its capacity yet, so a running game stops allocating
+    enemies. Iterating, len() and indexing only see the live enemies, in spawn order: removing shifts the later ones
+    down a slot, so the slots of the absolute observation mean the same as in vec_env.VecEnv, and a loop over the
+    pool can remove the enemy it's on and look at the same index next.
+    '''
+    __slots__ = ('capacity', 'active', 'free', 'created')
+
+    def __init__(self, capacity = MAX_ENEMIES):
+        self.capacity = capacity
+        self.active = []
+        self.free = []
+        self.created = 0
+
+    def __len__(self):
+        return len(self.active)
+
+    def __iter__(self):
+        return iter(self.active)
+
+    def __getitem__(self, i):
+        return self.active[i]
+
+    def spawn(self, rng = None):
+        '''
+        Takes a free enemy, re-spawned with rng, and makes it live.
+        '''
+        if self.free:
+            enemy = self.free.pop()
+            enemy.reset(rng)
+        elif self.created < self.capacity:
+            enemy = Enemy(rng)
+            self.created += 1
+        else:
+            raise ValueError(f"Enemy pool is full ({self.capacity} enemies)")
+        enemy.slot = len(self.active)
+        self.active.append(enemy)
+        return enemy
+
+    def remove_at(self, i):
+        '''
+        Frees the enemy in slot i, the ones after it move down a slot.
+        '''
+        active = self.active
+        enemy = active.pop(i)
+        for j in range(i, len(active)):
+            active[j].slot = j
+        enemy.slot = -1
+        self.free.append(enemy)
+
+    def remove(self, enemy):
+        self.remove_at(enemy.slot)
+
+    def clear(self):
+        for enemy in self.active:
+            enemy.slot = -1
+        self.free.extend(self.active)
+        self.active.clear()
+
+
+#########################################################################################################
+##########################          Environment          ################################################
+#########################################################################################################
+def spawn_enemy(player, enemies, grid = None, rng = None):
+    '''
+    Spawns an enemy from the EnemyPool enemies, aimed at the player, registering it in the spatial grid if there is one.
+    '''
+    enemy = enemies.spawn(rng)
+    enemy.set_target(player.pos)
+    if grid is not None:
+        grid.insert(enemy)
+    return enemy
+
+def step(player, action, enemies, grid = None, frames = 1, encoder = None): #Number of possible actions: up, down, left, right, top_left, top_right, down_right, down_left = 8
+    '''
+    Determines the next action taken, current reward and whether the player has been hit.
+    enemies is the EnemyPool of the game, check env_reset.
+    With a spatial.SpatialHash holding the enemies, the collision and closest enemy checks only look at the
+    cells around the player instead of every enemy. Every enemy is still moved (and re-hashed) one by one though, so
+    it's slower than grid=None at every enemy count measured so far, up to 1000.
+    frames > 1 makes a single coarse step covering that many logical frames: everything moves frames times as far,
+    the per-frame rewards are scaled to match, and enemies are tested with a swept collision so they can't jump over the player.
+    With an observation encoder (see observation.py) the state comes from it, otherwise it is the original absolute layout.
+    '''
+    done = False
+    reward = 0
+    spd = player.spd * frames
+
+    if action == 0:
+        player.set_dest((player.x - spd, player.y))
+    elif action == 1:
+        player.set_dest((player.x + spd, player.y))
+    elif action == 2:
+        player.set_dest((player.x, player.y - spd))
+    elif action == 3:
+        player.set_dest((player.x, player.y + spd))
+    elif action == 4:
+        player.set_dest((player.x - spd, player.y - spd))
+    elif action == 5:
+        player.set_dest((player.x - spd, player.y + spd))
+    elif action == 6:
+        player.set_dest((player.x + spd, player.y + spd))
+    elif action == 7:
+        player.set_dest((player.x + spd, player.y - spd))
+
+    if frames > 1: #Where the player starts the step, for the swept collision test
+        start_rect = Rect(player.rect.x, player.rect.y, player.rect.width, player.rect.height)
+    player.move(frames)
+    if frames > 1:
+        moved_x = player.rect.x - start_rect.x
+        moved_y = player.rect.y - start_rect.y
+
+    # To avoid the border-hugging situation, we will reward the agent if it stays close to the center of the screen
+    # Calculate distance from center
+    center_x, center_y = SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2
+    dist_from_center = math.hypot(player.x - center_x, player.y - center_y)
+
+    # Max possible distance is from corner to center
+    max_dist = math.hypot(center_x, center_y)
+
+    # Reward for being closer to the center (normalized from 0 to 1 to make it small and smooth)
+    # The closer to the center, the higher the reward
+    centering_reward = 1.0 - (dist_from_center / max_dist)
+    reward += centering_reward * frames
+
+    # Big penalty if the agent touches a border
+    if player.check_edge():
+        reward -= BORDER_PENALTY * frames
+
+    state = [] #Normalizing using the screen size
+    state.append(player.x / SCREEN_WIDTH)
+    state.append(player.y / SCREEN_HEIGHT)
+
+    if grid is not None:
+        #Only the enemies that can reach the player during this step need the exact test, both of them move meanwhile
+        reach = (ENEMY_SPD + player.spd) * frames if frames > 1 else 0
+        near = set(grid.query(player.rect.inflate(reach, reach)))
+
+    #Removing an enemy moves the next one into its slot, which is looked at next, so the loop never skips one
+    closest_enemy_dist = math.inf
+    i = 0
+    while i < len(enemies):
+        enemy = enemies[i]
+        if grid is not None and enemy not in near:
+            hit = False
+        else:
+            hit = player.collision(enemy.rect) or (frames > 1 and enemy.sweeps(start_rect, frames, moved_x, moved_y))
+
+        if hit:
+            removed = True
+            player.hp = player.hp - 1
+            reward -= HIT_PENALTY
+
+            if player.hp == 0:
+                done = True
+        else:
+            enemy.move(frames)
+            removed = enemy.out_of_screen()
+
+        #With the grid, the enemies still alive are left to grid.nearest below
+        if grid is None or removed:
+            closest_enemy_dist = min(closest_enemy_dist, math.hypot(player.x - enemy.x, player.y - enemy.y))
+
+        if encoder is None and len(state) < OBS_SIZE:
+            state.append(enemy.x / SCREEN_WIDTH)
+            state.append(enemy.y / SCREEN_HEIGHT)
+
+        if removed:
+            enemies.remove_at(i)
+            if grid is not None:
+                grid.remove(enemy)
+        else:
+            if grid is not None:
+                grid.update(enemy)
+            i += 1
+
+    while len(state) < OBS_SIZE:
+        state.append(-1.0)
+
+    if enemies: #The closer the enemy gets, lesser the reward received
+        if grid is not None:
+            for dist, enemy in grid.nearest(player.x, player.y, 1):
+                closest_enemy_dist = min(closest_enemy_dist, dist)
+        reward += DISTANCE_REWARD * closest_enemy_dist * frames
+
+    if encoder is not None:
+        return encoder.encode(player, enemies, grid), reward, done
+    return np.array(state, dtype=np.float64), reward, done
+
+def advance(player, action, enemies, n_enemies, frames_passed, grid = None, action_repeat = 1, coarse = False, encoder = None,
+            rng = None):
+    '''
+    Plays the same action for action_repeat logical frames, spawning enemies along the way, and sums the rewards.
+    With coarse=True the frames are simulated as one swept step instead of one step per frame, which is cheaper but approximate.
+    rng is the random.Random the enemies are spawned with, the global random module by default.
+    Returns the last state, the summed reward, done and the updated frames_passed.
+    '''
+    if coarse:
+        if len(enemies) < n_enemies and frames_passed > SPAWN_FRAMES:
+            spawn_enemy(player, enemies, grid, rng)
+            frames_passed = 0
+        state, reward, done = step(player, action, enemies, grid, frames=action_repeat, encoder=encoder)
+        return state, reward, done, frames_passed + action_repeat
+
+    #The encoder reuses its buffers, so it only runs once per call: the caller still holds the previous state
+    frame_encoder = encoder if action_repeat == 1 else None
+    total_reward = 0
+    for _ in range(action_repeat):
+        if len(enemies) < n_enemies and frames_passed > SPAWN_FRAMES:
+            spawn_enemy(player, enemies, grid, rng)
+            frames_passed = 0
+        frames_passed = frames_passed + 1
+
+        state, reward, done = step(player, action, enemies, grid, encoder=frame_encoder)
+        total_reward += reward
+        if done:
+            break
+    if encoder is not None and frame_encoder is None:
+        state = encoder.encode(player, enemies, grid)
+    return state, total_reward, done, frames_passed
+
+def env_reset(n_enemies = MAX_ENEMIES, grid = None, encoder = None, enemies = None):
+    '''
+    Resets the environment which marks the end of an episode.
+    Pass the EnemyPool of the last episode as enemies to reuse it, a new one holding n_enemies is made otherwise.
+    '''
+    player = Player()
+    if enemies is None or enemies.capacity < n_enemies:
+        enemies = EnemyPool(n_enemies)
+    else:
+        enemies.clear()
+    if grid is not None:
+        grid.clear()
+    frames_passed = 0
+    reward = 0
+    done = False
+
+    if encoder is not None:
+        return player, enemies, n_enemies, frames_passed, encoder.encode(player, enemies), reward, done
+
+    state = [player.x / SCREEN_WIDTH, player.y / SCREEN_HEIGHT]
+
+    while len(state) < OBS_SIZE:
+        state.append(-1.0)
+
+
+    return player, enemies, n_enemies, frames_passed, np.array(state, dtype=np.float64), reward, done
+
+
+def playable_tick(player, enemies, grid, n_enemies, frames_passed, score, max_enemies = MAX_ENEMIES, rng = None):
+    '''
+    One logical frame of the playable game, where the player walks to wherever it was last told to and the enemy count
+    grows by one every SPAWN_FRAMES frames, which is also the score. enemies is the game's EnemyPool, grid an optional
+    spatial.SpatialHash holding them (None checks every enemy directly, which is faster at these enemy counts).
+    Returns the updated n_enemies, frames_passed and score.
+    '''
+    if len(enemies) < n_enemies:
+        spawn_enemy(player, enemies, grid, rng)
+    frames_passed = frames_passed + 1
+
+    if frames_passed > SPAWN_FRAMES and n_enemies < max_enemies:
+        n_enemies = n_enemies + 1
+        frames_passed = 0
+        score = score + 1
+
+    hits = set(grid.query(player.rect)) if grid is not None else None
+    i = 0
+    while i < len(enemies): #Same removal loop as step
+        enemy = enemies[i]
+        if enemy in hits if hits is not None else player.collision(enemy.rect):
+            removed = True
+            player.hp = player.hp - 1
+
+        else:
+            enemy.move()
+            removed = enemy.out_of_screen()
+
+        if removed:
+            enemies.remove_at(i)
+            if grid is not None:
+                grid.remove(enemy)
+        else:
+            if grid is not None:
+                grid.update(enemy)
+            i += 1
+
+    player.move()
+    return n_enemies, frames_passed, score
+
+
+#For simplicity, a discrete amount of actions can be taken.
+action_map = {
+        0 : 'UP',
+        1 : 'DOWN',
+        2 : 'LEFT',
+        3 : 'RIGHT',
+        4 : 'TOP_LEFT',
+        5 : 'TOP_RIGHT',
+        6 : 'DOWN_RIGHT',
+        7 : 'DOWN_LEFT'
+    }
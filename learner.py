@@ -0,0 +1,119 @@
+import threading
+import contextlib
+from metrics import Metrics
+
+'''
+Decouples learning from the game loop.
+The game loop hands its experiences to a Learner, which decides when to train: every train_every environment steps
+it runs gradient_steps updates of batch_size experiences, either inline or on a background thread.
+'''
+
+class Learner:
+    '''
+    Runs agent updates at a configurable update-to-data ratio.
+    With background=True the updates happen on a separate thread and remember() never waits for backprop.
+    If the thread falls more than max_pending updates behind, the extra updates are dropped instead of piling up.
+    '''
+    def __init__(self, agent, train_every = 1, gradient_steps = 1, batch_size = None, background = False, max_pending = 64,
+                 metrics = None):
+        self.agent = agent
+        self.train_every = train_every
+        self.gradient_steps = gradient_steps
+        if batch_size is not None:
+            agent.batch_size = batch_size
+        self.background = background
+        self.max_pending = max_pending
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        self.env_steps = 0
+        self.updates = 0
+        self.losses = []
+
+        #Guards the replay memory, which the game loop writes while the learner thread samples it
+        self.memory_lock = threading.Lock()
+        #Held during every gradient step, hold it too to see the networks and optimizer in a consistent state
+        self.update_lock = threading.Lock()
+        self.pending = 0
+        self.wake = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.background and self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name='learner', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Stops the learner thread. Pending updates are discarded.
+        '''
+        if self.thread is not None:
+            with self.wake:
+                self.running = False
+                self.wake.notify()
+            self.thread.join()
+            self.thread = None
+
+    def remember(self, state, action, reward, next_state, done):
+        '''
+        Stores an experience and schedules training when it's due.
+        '''
+        start = self.metrics.now()
+        with self.memory_lock:
+            self.agent.remember(state, action, reward, next_state, done)
+        self.metrics.record_time('remember', start)
+        self.env_steps += 1
+
+        if self.env_steps % self.train_every == 0:
+            if self.background:
+                with self.wake:
+                    self.pending = min(self.pending + self.gradient_steps, self.max_pending)
+                    self.wake.notify()
+            else:
+                for _ in range(self.gradient_steps):
+                    self._update()
+
+    @contextlib.contextmanager
+    def paused(self):
+        '''
+        Context manager holding both locks, so nothing is learned or stored while it's active.
+        '''
+        with self.update_lock, self.memory_lock:
+            yield
+
+    def drain_losses(self):
+        '''
+        Returns the losses of the updates done since the last call.
+        '''
+        with self.wake:
+            losses, self.losses = self.losses, []
+        return losses
+
+    def _update(self):
+        agent = self.agent
+        start = self.metrics.now()
+        with self.memory_lock:
+            if len(agent.memory) < agent.batch_size: #Not enough experiences gained, just keep moving
+                return
+            batch = agent.memory.sample(agent.batch_size)
+        with self.update_lock:
+            loss, td_errors = agent.learn(batch)
+        if agent.prioritized:
+            with self.memory_lock:
+                agent.memory.update_priorities(batch[-1], td_errors)
+        with self.wake:
+            self.losses.append(loss)
+            self.updates += 1
+        self.metrics.record_time('replay', start)
+
+    def _run(self):
+        while True:
+            with self.wake:
+                while self.running and self.pending == 0:
+                    self.wake.wait()
+                if not self.running:
+                    return
+                self.pending -= 1
+            self._update()
@@ -0,0 +1,212 @@
+import csv
+import json
+import math
+import time
+import bisect
+
+'''
+Low-overhead instrumentation for the training loop.
+Timers, counters and value statistics are aggregated incrementally (nothing keeps the full history), and the
+store can be flushed to a JSONL or CSV file. The on-screen debug stats read from the same store.
+Timers are only active when the store is enabled, otherwise now() and record_time() return straight away.
+'''
+
+#Histogram buckets for timings, log-spaced from 1us to ~16s
+TIME_BUCKETS = [1e-6 * 2 ** (i / 2) for i in range(49)]
+
+
+class RunningStat:
+    '''
+    Count, mean, variance, min, max and last value, updated in O(1) per value (Welford's algorithm).
+    '''
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.last = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.last = value
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count > 1 else 0.0
+
+    def as_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max, 'last': self.last}
+
+
+class Histogram:
+    '''
+    Fixed-bucket histogram, used for approximate percentiles.
+    '''
+    __slots__ = ('edges', 'counts', 'total')
+
+    def __init__(self, edges = TIME_BUCKETS):
+        self.edges = edges
+        self.counts = [0] * (len(edges) + 1)
+        self.total = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.edges, value)] += 1
+        self.total += 1
+
+    def quantile(self, q):
+        '''
+        Upper edge of the bucket holding the q-th quantile.
+        '''
+        if self.total == 0:
+            return 0.0
+        target = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.edges[min(i, len(self.edges) - 1)]
+        return self.edges[-1]
+
+
+class Metrics:
+    '''
+    Store for the training metrics.
+    - Timers (per phase durations with a histogram), only recorded when enabled.
+    - Counters.
+    - Values: running statistics of things like the episode reward or loss, always kept since the HUD uses them.
+    - Gauges: last value of something, like the current episode or epsilon.
+    '''
+    def __init__(self, enabled = False, sink = None):
+        self.enabled = enabled
+        self.sink = sink
+        self.timers = {}
+        self.counters = {}
+        self.values = {}
+        self.gauges = {}
+        self.hud_fields = [] #(label, name, format) shown by draw_debug_stats
+
+    def now(self):
+        return time.perf_counter() if self.enabled else 0.0
+
+    def record_time(self, name, start):
+        '''
+        Records the time elapsed since start, which came from now().
+        '''
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter() - start
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = (RunningStat(), Histogram())
+        timer[0].add(elapsed)
+        timer[1].add(elapsed)
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        stat = self.values.get(name)
+        if stat is None:
+            stat = self.values[name] = RunningStat()
+        stat.add(value)
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def get(self, name, default = 0.0):
+        '''
+        Gauge value, or the mean of the running statistic with that name.
+        '''
+        if name in self.gauges:
+            return self.gauges[name]
+        stat = self.values.get(name)
+        return stat.mean if stat is not None else default
+
+    def show(self, label, name, fmt = '{}'):
+        '''
+        Adds a line to the on-screen debug stats.
+        '''
+        self.hud_fields.append((label, name, fmt))
+
+    def hud_items(self):
+        for label, name, fmt in self.hud_fields:
+            yield label, fmt.format(self.get(name))
+
+    def snapshot(self):
+        return {
+            'timers': {name: dict(stat.as_dict(), p50=hist.quantile(0.5), p99=hist.quantile(0.99))
+                       for name, (stat, hist) in self.timers.items()},
+            'counters': dict(self.counters),
+            'values': {name: stat.as_dict() for name, stat in self.values.items()},
+            'gauges': dict(self.gauges),
+        }
+
+    def flush(self, **fields):
+        '''
+        Writes the current aggregates to the sink, tagged with fields (for instance the episode).
+        '''
+        if self.sink is not None:
+            self.sink.write(fields, self.snapshot())
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+
+
+class JsonlSink:
+    '''
+    One JSON object per flush.
+    '''
+    def __init__(self, path):
+        self.file = open(path, 'a')
+
+    def write(self, fields, snapshot):
+        self.file.write(json.dumps(dict(fields, time=time.time(), **snapshot)) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CsvSink:
+    '''
+    Long format, one row per metric and flush, so new metrics never change the header.
+    '''
+    COLUMNS = ['time', 'tag', 'kind', 'name', 'count', 'mean', 'std', 'min', 'max', 'last', 'p50', 'p99', 'value']
+
+    def __init__(self, path):
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.COLUMNS)
+        if self.file.tell() == 0:
+            self.writer.writeheader()
+
+    def write(self, fields, snapshot):
+        now = time.time()
+        tag = ' '.join(f"{key}={value}" for key, value in fields.items())
+        for kind in ('timers', 'values'):
+            for name, stat in snapshot[kind].items():
+                self.writer.writerow(dict(stat, time=now, tag=tag, kind=kind[:-1], name=name))
+        for kind in ('counters', 'gauges'):
+            for name, value in snapshot[kind].items():
+                self.writer.writerow({'time': now, 'tag': tag, 'kind': kind[:-1], 'name': name, 'value': value})
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def open_sink(path):
+    '''
+    CSV sink for .csv files, JSONL otherwise.
+    '''
+    return CsvSink(path) if path.endswith('.csv') else JsonlSink(path)
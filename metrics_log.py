@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import numpy as np
+
+'''
+Append-only, downsampled log of the per-episode training metrics.
+Instead of holding every episode's reward and loss in memory until the end of the run, every episode is appended to
+disk as it finishes, at several resolutions: the raw episodes, and aggregates (mean, min, max) of every 100 and
+10000 episodes. A million-episode run keeps a flat memory footprint, and a viewer can tail the coarse levels while
+training goes on:
+
+    python metrics_log.py runs/my_run --follow
+
+A log is a directory holding schema.json and one file per level of fixed-size float64 records:
+    level_1.f64     episode, then one value per column
+    level_<n>.f64   last episode of the group, episodes in the group, then mean, min and max of every column
+Missing values (no loss yet, for instance) are NaN and are left out of the aggregates.
+'''
+
+LEVELS = (1, 100, 10_000)
+COLUMNS = ('reward', 'loss', 'length', 'epsilon')
+MAX_POINTS = 2000 #Most points the viewer plots per column, it picks the finest level that fits
+
+
+def _level_path(path, level):
+    return os.path.join(path, f"level_{level}.f64")
+
+
+def _record_size(n_columns, level):
+    return 1 + n_columns if level == 1 else 2 + 3 * n_columns
+
+
+class MetricsLog:
+    '''
+    Writer side. Appending an episode costs a handful of small writes, the files are flushed so readers see it at once.
+    Opening an existing log keeps appending to it, with the same columns and levels.
+    '''
+    def __init__(self, path, columns = COLUMNS, levels = LEVELS):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        schema_path = os.path.join(path, 'schema.json')
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                schema = json.load(f)
+            columns = tuple(schema['columns'])
+            levels = tuple(schema['levels'])
+        else:
+            with open(schema_path, 'w') as f:
+                json.dump({'columns': list(columns), 'levels': list(levels)}, f)
+        self.columns = columns
+        self.levels = levels
+        self.files = {level: open(_level_path(path, level), 'ab') for level in levels}
+
+        #Group being aggregated for every level above 1
+        n = len(columns)
+        self.group_size = {level: 0 for level in levels if level > 1}
+        self.sums = {level: np.zeros(n) for level in self.group_size}
+        self.counts = {level: np.zeros(n) for level in self.group_size}
+        self.mins = {level: np.full(n, np.inf) for level in self.group_size}
+        self.maxs = {level: np.full(n, -np.inf) for level in self.group_size}
+
+    def append(self, episode, **values):
+        '''
+        Appends one episode. Columns not given are NaN.
+        '''
+        row = np.array([values.get(column, np.nan) for column in self.columns], dtype=np.float64)
+        if 1 in self.files:
+            self.files[1].write(np.concatenate(([episode], row)).tobytes())
+            self.files[1].flush()
+
+        valid = ~np.isnan(row)
+        for level in self.group_size:
+            self.group_size[level] += 1
+            self.sums[level][valid] += row[valid]
+            self.counts[level][valid] += 1
+            np.fmin(self.mins[level], row, out=self.mins[level])
+            np.fmax(self.maxs[level], row, out=self.maxs[level])
+            if self.group_size[level] == level:
+                self._write_group(level, episode)
+
+    def _write_group(self, level, episode):
+        counts = self.counts[level]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.sums[level] / counts
+        empty = counts == 0
+        mins = np.where(empty, np.nan, self.mins[level])
+        maxs = np.where(empty, np.nan, self.maxs[level])
+        record = np.concatenate(([episode, self.group_size[level]], mean, mins, maxs))
+        self.files[level].write(record.tobytes())
+        self.files[level].flush()
+
+        self.group_size[level] = 0
+        self.sums[level].fill(0.0)
+        counts.fill(0.0)
+        self.mins[level].fill(np.inf)
+        self.maxs[level].fill(-np.inf)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+class MetricsLogReader:
+    '''
+    Reader side, safe to use while the log is being written: a record only counts once it's complete.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'schema.json')) as f:
+            schema = json.load(f)
+        self.columns = tuple(schema['columns'])
+        self.levels = tuple(schema['levels'])
+
+    def __len__(self):
+        '''
+        Episodes logged so far, from the finest level.
+        '''
+        return self.n_records(self.levels[0]) * self.levels[0]
+
+    def n_records(self, level):
+        path = _level_path(self.path, level)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // (8 * _record_size(len(self.columns), level))
+
+    def read(self, level, start = 0):
+        '''
+        Records of level from record number start on, as a dict of arrays:
+        'episode' and the columns for level 1, 'episode', 'count' and '<column>', '<column>_min', '<column>_max' above.
+        '''
+        width = _record_size(len(self.columns), level)
+        count = self.n_records(level) - start
+        if count <= 0:
+            data = np.zeros((0, width))
+        else:
+            data = np.fromfile(_level_path(self.path, level), dtype=np.float64, count=count * width,
+                               offset=start * width * 8).reshape(count, width)
+        result = {'episode': data[:, 0]}
+        n = len(self.columns)
+        if level == 1:
+            for i, column in enumerate(self.columns):
+                result[column] = data[:, 1 + i]
+        else:
+            result['count'] = data[:, 1]
+            for i, column in enumerate(self.columns):
+                result[column] = data[:, 2 + i]
+                result[f"{column}_min"] = data[:, 2 + n + i]
+                result[f"{column}_max"] = data[:, 2 + 2 * n + i]
+        return result
+
+    def best_level(self, max_points = MAX_POINTS):
+        '''
+        Finest level with at most max_points records, or the coarsest one.
+        '''
+        for level in sorted(self.levels):
+            if self.n_records(level) <= max_points:
+                return level
+        return max(self.levels)
+
+
+#########################################################################################################
+##########################          Viewer          #####################################################
+#########################################################################################################
+def plot_log(reader, axes, max_points = MAX_POINTS):
+    '''
+    Plots every column of the log, at the finest level that fits in max_points, with the min-max band for aggregates.
+    '''
+    level = reader.best_level(max_points)
+    data = reader.read(level)
+    for ax, column in zip(axes, reader.columns):
+        ax.clear()
+        ax.plot(data['episode'], data[column], linewidth=1)
+        if level > 1:
+            ax.fill_between(data['episode'], data[f"{column}_min"], data[f"{column}_max"], alpha=0.2)
+        ax.set_title(column if level == 1 else f"{column} (per {level} episodes)")
+    return level
+
+
+def show_log(path, follow = False, interval = 1.0):
+    '''
+    Plots the log at path, redrawing it every interval seconds with follow=True.
+    '''
+    import matplotlib.pyplot as plt
+
+    reader = MetricsLogReader(path)
+    fig, axes = plt.subplots(1, len(reader.columns), figsize=(16, 5))
+    axes = np.atleast_1d(axes)
+    plot_log(reader, axes)
+    if not follow:
+        plt.show()
+        return
+    while plt.fignum_exists(fig.number):
+        plot_log(reader, axes)
+        plt.pause(interval)
+
+
+def tail_log(path, level = None, interval = 1.0):
+    '''
+    Prints the records of a level as they get written, like tail -f. Works without a display.
+    '''
+    reader = MetricsLogReader(path)
+    if level is None:
+        level = 100 if 100 in reader.levels else reader.levels[0]
+    seen = 0
+    print('episode'.rjust(10) + ''.join(column.rjust(14) for column in reader.columns))
+    while True:
+        data = reader.read(level, seen)
+        for i in range(len(data['episode'])):
+            print(f"{int(data['episode'][i]):>10}" + ''.join(f"{data[column][i]:>14.4f}" for column in reader.columns))
+        seen += len(data['episode'])
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='View a training metrics log, live while it is being written.')
+    parser.add_argument('path', help='Log directory, as passed to train.py --log.')
+    parser.add_argument('--follow', action='store_true', help='Keep redrawing as new episodes are logged.')
+    parser.add_argument('--text', action='store_true', help='Print the records instead of plotting, like tail -f.')
+    parser.add_argument('--level', type=int, default=None, help='Level printed by --text, 100 by default.')
+    args = parser.parse_args()
+    try:
+        if args.text:
+            tail_log(args.path, args.level)
+        else:
+            show_log(args.path, args.follow)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,130 @@
+import heapq
+import math
+import numpy as np
+from game import SCREEN_WIDTH, SCREEN_HEIGHT, OBS_ENEMIES
+
+'''
+Observation layouts.
+The original ('absolute') observation lists the enemies in spawn order (the order of the game's EnemyPool), so what a
+slot means shifts every time an enemy is removed. The 'ego' observation only keeps the k nearest enemies, sorted by
+distance, relative to the player and with their velocities, which gives every slot a stable meaning and a smaller input.
+Every layout is described by an ObservationSpec, whose version gets bumped whenever the layout changes, so a
+checkpoint trained on one layout can't silently be loaded with another.
+'''
+
+K_NEAREST = 6
+
+
+class ObservationSpec:
+    '''
+    Describes an observation layout: the player fields, then k enemy slots of enemy_fields each.
+    '''
+    def __init__(self, name, version, player_fields, enemy_fields, k):
+        self.name = name
+        self.version = version
+        self.player_fields = tuple(player_fields)
+        self.enemy_fields = tuple(enemy_fields)
+        self.k = k
+        self.size = len(self.player_fields) + k * len(self.enemy_fields)
+
+    def layout(self):
+        '''
+        Name of every column of the observation.
+        '''
+        names = [f"player.{field}" for field in self.player_fields]
+        for i in range(self.k):
+            names.extend(f"enemy{i}.{field}" for field in self.enemy_fields)
+        return names
+
+    def as_dict(self):
+        return {'name': self.name, 'version': self.version, 'size': self.size, 'layout': self.layout()}
+
+    def encoder(self):
+        '''
+        Encoder for this layout, or None for the absolute one which game.step builds by itself.
+        '''
+        if self.name == 'absolute':
+            return None
+        return EgoEncoder(self)
+
+
+SPECS = {
+    #x, y normalized by the screen size, missing enemies are -1.0
+    'absolute': ObservationSpec('absolute', 1, ('x', 'y'), ('x', 'y'), OBS_ENEMIES),
+    #Player x, y normalized by the screen size. Per enemy, nearest first: whether the slot holds an enemy, its offset
+    #from the player normalized by the screen size and its direction of travel (its velocity in units of ENEMY_SPD).
+    #Missing enemies are all zeros.
+    'ego': ObservationSpec('ego', 1, ('x', 'y'), ('present', 'dx', 'dy', 'vx', 'vy'), K_NEAREST),
+}
+
+
+def get_spec(name):
+    try:
+        return SPECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown observation {name!r}, expected one of {', '.join(SPECS)}") from None
+
+
+class EgoEncoder:
+    '''
+    Writes ego observations into two reused float32 buffers, alternating between them.
+    The returned array stays valid until the call after the next one, which is enough to hold on to the current
+    state while encoding the next one (as the training loop does), but it has to be copied to be kept longer.
+    '''
+    def __init__(self, spec):
+        self.spec = spec
+        self.k = spec.k
+        self.buffers = np.zeros((2, spec.size), dtype=np.float32)
+        self.current = 0
+
+    def encode(self, player, enemies, grid = None):
+        '''
+        Observation of player and the enemies around it. With a spatial.SpatialHash only the cells around the player are searched.
+        '''
+        self.current ^= 1
+        obs = self.buffers[self.current]
+        obs.fill(0.0)
+        px = player.x
+        py = player.y
+        obs[0] = px / SCREEN_WIDTH
+        obs[1] = py / SCREEN_HEIGHT
+
+        if grid is not None:
+            nearest = [enemy for dist, enemy in grid.nearest(px, py, self.k)]
+        elif len(enemies) > self.k:
+            nearest = heapq.nsmallest(self.k, enemies, key=lambda enemy: math.hypot(enemy.x - px, enemy.y - py))
+        else:
+            nearest = sorted(enemies, key=lambda enemy: math.hypot(enemy.x - px, enemy.y - py))
+
+        i = 2
+        for enemy in nearest:
+            obs[i] = 1.0
+            obs[i + 1] = (enemy.x - px) / SCREEN_WIDTH
+            obs[i + 2] = (enemy.y - py) / SCREEN_HEIGHT
+            obs[i + 3] = enemy.dir_x
+            obs[i + 4] = enemy.dir_y
+            i += 5
+        return obs
+
+
+def encode_ego_batch(player_pos, enemy_pos, enemy_dir, present, k, out):
+    '''
+    Vectorized EgoEncoder.encode for vec_env.VecEnv: player_pos is (n, 2), the enemy arrays are (n, slots, 2)
+    and present (n, slots) says which slots hold an enemy. Writes the (n, 2 + 5 * k) observations into out.
+    '''
+    n = len(player_pos)
+    scale = np.array([SCREEN_WIDTH, SCREEN_HEIGHT], dtype=np.float64)
+    offset = enemy_pos - player_pos[:, None, :]
+    dist = np.where(present, np.hypot(offset[:, :, 0], offset[:, :, 1]), np.inf)
+    order = np.argsort(dist, axis=1, kind='stable')[:, :k]
+    rows = np.arange(n)[:, None]
+
+    enemies = out[:, 2:].reshape(n, -1, 5)
+    width = order.shape[1]
+    enemies[:, :width, 0] = present[rows, order]
+    enemies[:, :width, 1:3] = offset[rows, order] / scale
+    enemies[:, :width, 3:5] = enemy_dir[rows, order]
+    enemies[:, :width] *= enemies[:, :width, 0:1] #Missing enemies are all zeros
+    enemies[:, width:] = 0.0
+    out[:, 0:2] = player_pos / scale
+    return out
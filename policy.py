@@ -0,0 +1,74 @@
+import warnings
+import numpy as np
+import torch
+
+'''
+Inference path for acting.
+Acting happens once per frame per game, so the fixed cost of each forward pass matters more than the FLOPs: the
+states are copied into a preallocated float32 buffer instead of building a new tensor every call, autograd is off
+(inference_mode) and dropout is left out. The same parameters as the training network are used, so the policy always
+acts with the latest weights without copying them or switching the network between train and eval mode.
+'''
+
+COMPILE_MODES = (None, 'trace', 'compile')
+
+
+def inference_layers(network):
+    '''
+    The layers of a Sequential q network without its Dropout layers, which are the identity at inference time.
+    The parameters are shared with network.
+    '''
+    return torch.nn.Sequential(*[layer for layer in network if not isinstance(layer, torch.nn.Dropout)])
+
+
+class Policy:
+    '''
+    Greedy policy over a q network, for a single state or a batch of them.
+    - max_batch: size of the preallocated input buffer, bigger batches are split.
+    - compile: None, 'trace' (torch.jit.trace) or 'compile' (torch.compile, needs a working compiler toolchain).
+    '''
+    def __init__(self, network, max_batch = 1024, compile = None):
+        if compile not in COMPILE_MODES:
+            raise ValueError(f"compile must be one of {COMPILE_MODES}, got {compile!r}")
+        self.obs_size = network[0].in_features
+        self.max_batch = max_batch
+        self.input = torch.zeros((max_batch, self.obs_size), dtype=torch.float32)
+        self.input_np = self.input.numpy() #Same memory as self.input, np.copyto casts into it without allocating
+        self.actions = np.zeros(max_batch, dtype=np.int64)
+
+        model = inference_layers(network)
+        if compile == 'trace':
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore') #Deprecation warning on recent torch versions
+                model = torch.jit.trace(model, self.input[:1])
+        elif compile == 'compile':
+            model = torch.compile(model, dynamic=True)
+        self.model = model
+
+    def q_values(self, states):
+        '''
+        Q values of a (n, obs_size) batch, as a tensor. n can't be more than max_batch.
+        '''
+        n = len(states)
+        np.copyto(self.input_np[:n], states, casting='unsafe')
+        with torch.inference_mode():
+            return self.model(self.input[:n])
+
+    def act(self, state):
+        '''
+        Greedy action for a single state.
+        '''
+        np.copyto(self.input_np[0], state, casting='unsafe')
+        with torch.inference_mode():
+            return int(self.model(self.input[:1]).argmax())
+
+    def act_batch(self, states):
+        '''
+        Greedy actions for a (n, obs_size) batch of states. The returned array is reused by the next call.
+        '''
+        n = len(states)
+        out = self.actions[:n] if n <= self.max_batch else np.empty(n, dtype=np.int64)
+        for start in range(0, n, self.max_batch):
+            chunk = states[start:start + self.max_batch]
+            out[start:start + len(chunk)] = self.q_values(chunk).argmax(dim=1).numpy()
+        return out
@@ -0,0 +1,230 @@
+import os
+import sys
+import socket
+import struct
+import asyncio
+import numpy as np
+import torch
+from policy import Policy
+from checkpoint import load_q_network
+from observation import get_spec
+
+'''
+Policy server, so many games can act with one trained network at once.
+Every game keeps a connection open and sends its observation every frame. The server gathers the observations that
+come in within max_wait seconds (or until max_batch of them) into a single batch, runs one forward pass for all of them
+and answers every game with its action. The weights are reloaded whenever the checkpoint file changes.
+
+    python policy_server.py checkpoint.pt --socket /tmp/dodgesquare.sock
+    python policy_server.py checkpoint.pt --port 8765
+
+Protocol, everything little-endian:
+    server -> client, on connect: HELLO (magic, observation size, number of actions, observation layout name)
+    client -> server: the observation, float32[observation size]
+    server -> client: the action, one uint8
+A connection has one observation in flight at a time, one connection per game. PolicyClient implements the client side.
+'''
+
+MAGIC = b'DSQP'
+HELLO = struct.Struct('<4sHB16s') #magic, obs_size, n_actions, observation name
+MAX_BATCH = 256
+MAX_WAIT = 0.002 #Seconds the first observation of a batch waits for others to join it
+WATCH_INTERVAL = 1.0 #Seconds between two checks of the checkpoint file
+
+
+class PolicyServer:
+    '''
+    Micro-batching server around a q network. Runs on an asyncio loop, check serve().
+    '''
+    def __init__(self, network, observation = 'absolute', max_batch = MAX_BATCH, max_wait = MAX_WAIT):
+        self.observation = observation
+        self.obs_size = get_spec(observation).size
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.set_network(network)
+        self.states = np.zeros((max_batch, self.obs_size), dtype=np.float32)
+        self.queue = asyncio.Queue()
+        self.requests = 0
+        self.batches = 0
+        self.reloads = 0
+
+    def set_network(self, network):
+        '''
+        Swaps the network in. Batches are run one at a time on the loop, so the swap happens between two of them.
+        '''
+        if network[0].in_features != self.obs_size:
+            raise ValueError(f"Network takes {network[0].in_features} inputs, the {self.observation} observation is {self.obs_size}")
+        self.n_actions = network[-1].out_features
+        self.policy = Policy(network, max_batch=self.max_batch)
+
+    def stats(self):
+        return {'requests': self.requests, 'batches': self.batches, 'reloads': self.reloads,
+                'mean_batch': self.requests / self.batches if self.batches else 0.0}
+
+    async def reload(self, path):
+        '''
+        Loads the q network of the checkpoint at path (off the loop, so the games keep being served) and swaps it in.
+        '''
+        network, observation = await asyncio.get_running_loop().run_in_executor(None, load_q_network, path)
+        if observation != self.observation:
+            raise ValueError(f"{path} was trained on the {observation} observation, the server serves {self.observation}")
+        self.set_network(network)
+        self.reloads += 1
+
+    async def watch(self, path, interval = WATCH_INTERVAL):
+        '''
+        Reloads the checkpoint at path every time it changes. train.py replaces checkpoints atomically, so a
+        changed file is always complete. A checkpoint that fails to load is reported and the old weights are kept.
+        '''
+        last = os.stat(path).st_mtime_ns
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                if mtime != last:
+                    last = mtime
+                    await self.reload(path)
+                    print(f"Reloaded {path}", file=sys.stderr)
+            except (OSError, ValueError, RuntimeError) as e:
+                print(f"Could not reload {path}: {e}", file=sys.stderr)
+
+    async def batcher(self):
+        '''
+        Forms the batches: takes everything already waiting, then keeps waiting for more until max_wait has passed
+        since the first observation of the batch, or max_batch is reached.
+        '''
+        loop = asyncio.get_running_loop()
+        futures = []
+        while True:
+            data, future = await self.queue.get()
+            deadline = loop.time() + self.max_wait
+            futures.clear()
+            self.states[0] = np.frombuffer(data, dtype=np.float32)
+            futures.append(future)
+            while len(futures) < self.max_batch:
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        data, future = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    data, future = self.queue.get_nowait()
+                self.states[len(futures)] = np.frombuffer(data, dtype=np.float32)
+                futures.append(future)
+
+            actions = self.policy.act_batch(self.states[:len(futures)])
+            for future, action in zip(futures, actions):
+                if not future.done(): #Its game disconnected meanwhile
+                    future.set_result(int(action))
+            self.requests += len(futures)
+            self.batches += 1
+
+    async def handle(self, reader, writer):
+        '''
+        Serves one game connection.
+        '''
+        loop = asyncio.get_running_loop()
+        name = self.observation.encode()
+        writer.write(HELLO.pack(MAGIC, self.obs_size, self.n_actions, name))
+        frame = 4 * self.obs_size
+        try:
+            while True:
+                data = await reader.readexactly(frame)
+                future = loop.create_future()
+                self.queue.put_nowait((data, future))
+                writer.write(bytes((await future,)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass #The game went away
+        finally:
+            writer.close()
+
+    async def serve(self, path = None, host = '127.0.0.1', port = None, checkpoint = None, ready = None):
+        '''
+        Serves games on the Unix socket at path, or on host:port over TCP, until cancelled.
+        With a checkpoint path, the weights follow that file. ready, an optional threading.Event, is set once
+        the server accepts connections.
+        '''
+        if path is not None:
+            if os.path.exists(path):
+                os.remove(path) #Left behind by a server that didn't shut down cleanly
+            server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        tasks = [asyncio.create_task(self.batcher())]
+        if checkpoint is not None:
+            tasks.append(asyncio.create_task(self.watch(checkpoint)))
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+
+class PolicyClient:
+    '''
+    Blocking client for games, one per game: act(state) sends the observation and returns the server's action.
+    address is the path of a Unix socket or a (host, port) tuple.
+    '''
+    def __init__(self, address, observation = None):
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) #Observations are tiny, don't hold them back
+        self.sock.connect(address)
+        magic, self.obs_size, self.n_actions, name = HELLO.unpack(self._recv(HELLO.size))
+        if magic != MAGIC:
+            raise ValueError(f"{address} is not a policy server")
+        self.observation = name.rstrip(b'\0').decode()
+        if observation is not None and observation != self.observation:
+            raise ValueError(f"Server at {address} serves the {self.observation} observation, not {observation}")
+        self.buffer = np.zeros(self.obs_size, dtype=np.float32)
+
+    def _recv(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("Policy server closed the connection")
+            data += chunk
+        return data
+
+    def act(self, state):
+        np.copyto(self.buffer, state, casting='unsafe')
+        self.sock.sendall(self.buffer)
+        return self._recv(1)[0]
+
+    def close(self):
+        self.sock.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve a trained agent to many games at once, batching their requests.')
+    parser.add_argument('checkpoint', help='Checkpoint written by train.py --checkpoint, reloaded whenever it changes.')
+    parser.add_argument('--socket', help='Unix socket path to listen on, instead of TCP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help='Most observations in one forward pass.')
+    parser.add_argument('--max-wait', type=float, default=MAX_WAIT * 1000,
+                        help='Milliseconds an observation may wait for others to fill its batch.')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1) #Batches are small, threads mostly add latency
+    network, observation = load_q_network(args.checkpoint)
+    server = PolicyServer(network, observation, args.max_batch, args.max_wait / 1000)
+    print(f"Serving {args.checkpoint} ({observation} observation) on {args.socket or f'{args.host}:{args.port}'}")
+    try:
+        asyncio.run(server.serve(args.socket, args.host, args.port, checkpoint=args.checkpoint))
+    except KeyboardInterrupt:
+        stats = server.stats()
+        print(f"{stats['requests']} requests in {stats['batches']} batches (mean {stats['mean_batch']:.1f}), "
+              f"{stats['reloads']} reloads")
@@ -0,0 +1,263 @@
+import mmap
+import random
+import struct
+from array import array
+import numpy as np
+from game import MAX_ENEMIES, Player, EnemyPool, advance, playable_tick
+
+'''
+Episode recordings.
+Every game is played with its own seeded random.Random, so an episode is fully described by its seed and the actions
+taken, which is what gets stored: a few bytes per decision. The positions of the player and the enemies can be stored
+too, for frame lookups without re-simulating and for offline datasets.
+
+File layout, everything little-endian and append-only:
+    FILE_MAGIC
+    episode block, episode block, ...
+Each block is an EPISODE_HEADER followed by the arrays:
+    actions     uint8[n] (agent episodes) or int16[n, 2] (playable episodes, where the player was told to go)
+    rewards     float32[n]
+    if the positions are stored:
+    player      float32[n, 2]
+    counts      uint16[n], enemies on screen after every step
+    enemies     float32[sum(counts), 2]
+A block is written in one go once its episode finishes, so a crash can only lose the episode being played.
+'''
+
+FILE_MAGIC = b'DSQREC01'
+EPISODE_MAGIC = b'EPIS'
+#magic, kind, flags, action_repeat, coarse, n_enemies, episode, seed, n_steps, n_enemy_positions, total_reward
+EPISODE_HEADER = struct.Struct('<4sBBBBHIQIId')
+
+KIND_AGENT = 0
+KIND_PLAYABLE = 1
+FLAG_POSITIONS = 1
+
+
+def episode_seed(seed, episode):
+    '''
+    Seed of an episode, derived from the seed of the run so any episode can be replayed on its own.
+    '''
+    if seed is None:
+        return random.getrandbits(63)
+    return (seed * 1_000_003 + episode) % 2 ** 63
+
+
+class EpisodeRecorder:
+    '''
+    Streams episodes to an append-only recording file.
+    Call begin() at the start of every episode, record() after every step and end() once it's over.
+    '''
+    def __init__(self, path, positions = False):
+        self.path = path
+        self.positions = positions
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(FILE_MAGIC)
+        self.active = False
+
+    def begin(self, seed, kind = KIND_AGENT, episode = 0, n_enemies = MAX_ENEMIES, action_repeat = 1, coarse = False):
+        self.seed = seed
+        self.kind = kind
+        self.episode = episode
+        self.n_enemies = n_enemies
+        self.action_repeat = action_repeat
+        self.coarse = coarse
+        self.actions = array('B') if kind == KIND_AGENT else array('h')
+        self.rewards = array('f')
+        self.player = array('f')
+        self.counts = array('H')
+        self.enemies = array('f')
+        self.total_reward = 0.0
+        self.active = True
+
+    def record(self, action, reward, player = None, enemies = None):
+        '''
+        action is the action index for agent episodes, the (x, y) destination for playable ones.
+        player and enemies are only read when the positions are stored.
+        '''
+        if self.kind == KIND_AGENT:
+            self.actions.append(action)
+        else:
+            self.actions.extend((int(action[0]), int(action[1])))
+        self.rewards.append(reward)
+        self.total_reward += reward
+        if self.positions:
+            self.player.extend((player.x, player.y))
+            self.counts.append(len(enemies))
+            for enemy in enemies:
+                self.enemies.extend((enemy.x, enemy.y))
+
+    def end(self):
+        '''
+        Writes the finished episode.
+        '''
+        if not self.active:
+            return
+        self.active = False
+        header = EPISODE_HEADER.pack(EPISODE_MAGIC, self.kind, FLAG_POSITIONS if self.positions else 0,
+                                     self.action_repeat, int(self.coarse), self.n_enemies, self.episode, self.seed,
+                                     len(self.rewards), len(self.enemies) // 2, self.total_reward)
+        parts = [header, self.actions.tobytes(), self.rewards.tobytes()]
+        if self.positions:
+            parts.extend((self.player.tobytes(), self.counts.tobytes(), self.enemies.tobytes()))
+        self.file.write(b''.join(parts))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Episode:
+    '''
+    One recorded episode. The arrays are read-only views into the recording file.
+    '''
+    def __init__(self, buf, offset):
+        (magic, self.kind, flags, self.action_repeat, coarse, self.n_enemies, self.episode, self.seed, n_steps,
+         n_enemy_positions, self.total_reward) = EPISODE_HEADER.unpack_from(buf, offset)
+        if magic != EPISODE_MAGIC:
+            raise ValueError(f"Corrupted recording, no episode at offset {offset}")
+        self.coarse = bool(coarse)
+        self.n_steps = n_steps
+        self.has_positions = bool(flags & FLAG_POSITIONS)
+
+        offset += EPISODE_HEADER.size
+        if self.kind == KIND_AGENT:
+            self.actions = np.frombuffer(buf, np.uint8, n_steps, offset)
+        else:
+            self.actions = np.frombuffer(buf, np.int16, 2 * n_steps, offset).reshape(n_steps, 2)
+        offset += self.actions.nbytes
+        self.rewards = np.frombuffer(buf, np.float32, n_steps, offset)
+        offset += self.rewards.nbytes
+        if self.has_positions:
+            self.player = np.frombuffer(buf, np.float32, 2 * n_steps, offset).reshape(n_steps, 2)
+            offset += self.player.nbytes
+            self.counts = np.frombuffer(buf, np.uint16, n_steps, offset)
+            offset += self.counts.nbytes
+            self.enemies = np.frombuffer(buf, np.float32, 2 * n_enemy_positions, offset).reshape(n_enemy_positions, 2)
+            offset += self.enemies.nbytes
+            self.starts = np.concatenate(([0], np.cumsum(self.counts, dtype=np.int64)))
+        self.end = offset
+        #Replay behind frame() for episodes without positions: the generator, its last step and that frame
+        self.replay = None
+        self.replay_step = -1
+        self.replay_frame = None
+
+    def __len__(self):
+        return self.n_steps
+
+    def frame(self, i):
+        '''
+        (player position, (k, 2) array of enemy positions) after step i.
+        Read straight from the file when the positions are stored, re-simulated from the seed otherwise. The replay is
+        kept between calls, so going forward through the frames only simulates the steps in between; going back
+        starts it over.
+        '''
+        if self.has_positions:
+            return self.player[i], self.enemies[self.starts[i]:self.starts[i + 1]]
+        if i < 0:
+            i += self.n_steps
+        if not 0 <= i < self.n_steps:
+            raise IndexError(i)
+        if self.replay_frame is None or self.replay_frame[0] != i:
+            if self.replay is None or i < self.replay_step:
+                self.replay = self.simulate()
+                self.replay_step = -1
+            while self.replay_step < i:
+                player, enemies, reward = next(self.replay)
+                self.replay_step += 1
+            self.replay_frame = (i, np.array(player.pos), np.array([enemy.pos for enemy in enemies]).reshape(-1, 2))
+        return self.replay_frame[1], self.replay_frame[2]
+
+    def simulate(self):
+        '''
+        Replays the episode from its seed and actions, yielding (player, enemies, reward) after every step.
+        The objects are the live game state, copy what needs to outlive the next step.
+        '''
+        rng = random.Random(self.seed)
+        player = Player()
+        enemies = EnemyPool(self.n_enemies)
+        if self.kind == KIND_AGENT:
+            frames_passed = 0
+            for action in self.actions:
+                state, reward, done, frames_passed = advance(player, int(action), enemies, self.n_enemies, frames_passed,
+                                                             action_repeat=self.action_repeat, coarse=self.coarse, rng=rng)
+                yield player, enemies, reward
+        else:
+            n_enemies, frames_passed, score = 1, 0, 0
+            for dest in self.actions:
+                player.set_dest((int(dest[0]), int(dest[1])))
+                last_score = score
+                n_enemies, frames_passed, score = playable_tick(player, enemies, None, n_enemies, frames_passed, score,
+                                                                self.n_enemies, rng)
+                yield player, enemies, score - last_score
+
+
+class Recording:
+    '''
+    Read access to a recording file. Memory-mapped, so opening even a huge recording only reads the episode headers.
+    '''
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[:len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError(f"{path} is not an episode recording")
+        self.offsets = []
+        offset = len(FILE_MAGIC)
+        size = len(self.buf)
+        while offset + EPISODE_HEADER.size <= size:
+            try:
+                episode = Episode(self.buf, offset)
+            except ValueError: #Last block only partly written
+                break
+            self.offsets.append(offset)
+            offset = episode.end
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        return Episode(self.buf, self.offsets[i])
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield Episode(self.buf, offset)
+
+    def close(self):
+        self.buf.close()
+        self.file.close()
+
+
+def verify(episode):
+    '''
+    Re-simulates the episode and checks it against the recorded rewards (and positions, if stored).
+    Returns the index of the first step that doesn't match, or None when the whole episode matches.
+    '''
+    for i, (player, enemies, reward) in enumerate(episode.simulate()):
+        if not np.isclose(reward, episode.rewards[i], rtol=1e-5, atol=1e-3):
+            return i
+        if episode.has_positions:
+            recorded_player, recorded_enemies = episode.frame(i)
+            positions = np.array([enemy.pos for enemy in enemies], dtype=np.float32).reshape(-1, 2)
+            if not (np.allclose(recorded_player, player.pos, atol=1e-2) and positions.shape == recorded_enemies.shape
+                    and np.allclose(positions, recorded_enemies, atol=1e-2)):
+                return i
+    return None
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Summarize and check an episode recording.')
+    parser.add_argument('path')
+    parser.add_argument('--verify', action='store_true', help='Re-simulate every episode and compare it with the recording.')
+    args = parser.parse_args()
+
+    recording = Recording(args.path)
+    for episode in recording:
+        kind = 'agent' if episode.kind == KIND_AGENT else 'playable'
+        line = f"episode {episode.episode:>6} {kind:>8} seed={episode.seed} steps={episode.n_steps} reward={episode.total_reward:.2f}"
+        if args.verify:
+            mismatch = verify(episode)
+            line += ' ok' if mismatch is None else f" MISMATCH at step {mismatch}"
+        print(line)
+    print(f"{len(recording)} episodes")
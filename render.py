@@ -0,0 +1,367 @@
+import os
+import sys
+import queue
+import shutil
+import subprocess
+import multiprocessing as mp
+import pygame
+from game import SCREEN_WIDTH, SCREEN_HEIGHT, TICK_RATE
+from debug import ScrollingText, draw_debug_stats, draw_stat_lines
+from text_cache import render_text
+
+'''
+Optional pygame renderer on top of the headless game core in game.py.
+TrainingRenderer draws the training episodes inline, in the window of the main menu. AsyncTrainingRenderer hands
+them to separate processes instead, which show them and/or export them as PNG sequences or videos, so training
+never waits on the drawing.
+'''
+
+BG = (90,90,90)
+PLAYER_COLOR = (0,0,0)
+HP_COLOR = (0,255,0)
+ENEMY_COLOR = (156,156,156)
+
+
+def draw_player(screen, player):
+    '''
+    Draws the player square on the screen at the position player.pos, plus the hp bar.
+    Returns the rects that were drawn, like every draw function in here.
+    '''
+    return draw_player_rect(screen, player.rect.as_tuple(), player.hp)
+
+
+def draw_player_rect(screen, rect, hp):
+    '''
+    Same as draw_player, from the (x, y, width, height) rect and the hp.
+    '''
+    rects = [pygame.draw.rect(screen, PLAYER_COLOR, rect)]
+
+    for i in range(1, hp+1):
+        rects.append(pygame.draw.rect(screen, HP_COLOR, (25*i, 25, 10, 5)))
+    return rects
+
+
+def draw_enemies(screen, enemies):
+    '''
+    Draws every enemy square on the screen.
+    '''
+    return draw_enemy_rects(screen, (enemy.rect.as_tuple() for enemy in enemies))
+
+
+def draw_enemy_rects(screen, rects):
+    return [pygame.draw.rect(screen, ENEMY_COLOR, rect) for rect in rects]
+
+
+class DirtyRectRenderer:
+    '''
+    Only pushes the parts of the screen that changed to the display.
+    Every frame, begin() paints the background back over what was drawn on the previous frame, the new frame is drawn
+    with rect()/blit()/add(), and end() updates the display with both the old and the new rects.
+    After invalidate() (or on the first frame) the whole screen is redrawn and flipped instead.
+    '''
+    def __init__(self, screen, background = None):
+        self.screen = screen
+        if background is None:
+            background = pygame.Surface(screen.get_size())
+            background.fill(BG)
+        self.background = background
+        self.previous = []
+        self.current = []
+        self.full_redraw = True
+
+    def invalidate(self):
+        '''
+        Call when something else drew over the screen, so the next frame redraws it all.
+        '''
+        self.full_redraw = True
+        self.previous = []
+
+    def begin(self):
+        if self.full_redraw:
+            self.screen.blit(self.background, (0, 0))
+        else:
+            for rect in self.previous:
+                self.screen.blit(self.background, rect, rect)
+
+    def rect(self, color, rect):
+        self.current.append(pygame.draw.rect(self.screen, color, rect))
+
+    def blit(self, surface, pos):
+        self.current.append(self.screen.blit(surface, pos))
+
+    def add(self, rects):
+        '''
+        Adds the rects drawn by someone else, like draw_player or draw_enemies.
+        '''
+        self.current.extend(rects)
+
+    def end(self):
+        if self.full_redraw:
+            pygame.display.flip()
+            self.full_redraw = False
+        else:
+            pygame.display.update(self.previous + self.current)
+        self.previous = self.current
+        self.current = []
+
+
+class TrainingRenderer:
+    '''
+    Draws the training episodes that agent_training_loop decides to render.
+    The loop itself never imports pygame, it only calls poll() and draw().
+    '''
+    def __init__(self, screen, clock, font, action_text, fps = 0):
+        self.screen = screen
+        self.clock = clock
+        self.font = font
+        self.action_text = action_text
+        self.fps = fps #0 runs uncapped
+        self.dirty = DirtyRectRenderer(screen)
+        self.last_eps = None
+
+    def poll(self):
+        '''
+        Handles the window events so it stays responsive, even on episodes that are not drawn.
+        '''
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+
+    def draw(self, eps, player, enemies, metrics, action_name):
+        '''
+        Draws a single training frame.
+        '''
+        if eps != self.last_eps: #The screen wasn't updated during the episodes that are not drawn
+            self.dirty.invalidate()
+            self.last_eps = eps
+
+        dirty = self.dirty
+        dirty.begin()
+        dirty.add(draw_player(self.screen, player))
+        dirty.add(draw_enemies(self.screen, enemies))
+
+        eps_text = render_text(self.font, f"EPISODE:{eps}", (255,255,255))
+        dirty.blit(eps_text, (1150, 50))
+        dirty.add(draw_debug_stats(self.screen, self.font, metrics, self.screen.get_width(), self.screen.get_height()))
+
+        self.action_text.add_text(action_name)
+        dirty.add(self.action_text.render())
+        dirty.end()
+
+        self.clock.tick(self.fps)
+
+
+#########################################################################################################
+##########################          Off-process rendering          ######################################
+#########################################################################################################
+FRAME_QUEUE_SIZE = 64 #Frames waiting for the window, newer frames are dropped when it's full
+EPISODE_QUEUE_SIZE = 4 #Whole episodes waiting for the exporter, newer episodes are skipped when it's full
+EXPORT_FORMATS = ('png', 'mp4')
+
+
+def frame_snapshot(eps, player, enemies, metrics, action_name):
+    '''
+    What the render processes need of a frame, as plain tuples so it's cheap to pickle.
+    '''
+    return (eps, player.rect.as_tuple(), player.hp, tuple(enemy.rect.as_tuple() for enemy in enemies),
+            tuple(metrics.hud_items()), action_name)
+
+
+def draw_frame(screen, frame, font, action_text):
+    '''
+    Draws a whole frame_snapshot on screen.
+    '''
+    eps, player_rect, hp, enemy_rects, hud_items, action_name = frame
+    screen.fill(BG)
+    draw_player_rect(screen, player_rect, hp)
+    draw_enemy_rects(screen, enemy_rects)
+    screen.blit(render_text(font, f"EPISODE:{eps}", (255,255,255)), (1150, 50))
+    draw_stat_lines(screen, font, hud_items, screen.get_width(), screen.get_height())
+    action_text.add_text(action_name)
+    action_text.render()
+
+
+def check_export_format(export_format):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"export_format must be one of {EXPORT_FORMATS}, got {export_format!r}")
+    if export_format == 'mp4' and shutil.which('ffmpeg') is None:
+        raise ValueError("Exporting mp4 videos needs ffmpeg on the PATH, export png sequences instead")
+
+
+class EpisodeExporter:
+    '''
+    Writes the frames of every episode, to <directory>/episode_<n>/<frame>.png or to <directory>/episode_<n>.mp4
+    (piped to ffmpeg at fps frames per second).
+    '''
+    def __init__(self, directory, export_format = 'png', fps = TICK_RATE):
+        check_export_format(export_format)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.export_format = export_format
+        self.fps = fps
+        self.eps = None
+        self.frame = 0
+        self.ffmpeg = None
+
+    def add(self, eps, surface):
+        if eps != self.eps:
+            self._finish()
+            self.eps = eps
+            self.frame = 0
+            if self.export_format == 'png':
+                os.makedirs(os.path.join(self.directory, f"episode_{eps:06d}"), exist_ok=True)
+            else:
+                width, height = surface.get_size()
+                self.ffmpeg = subprocess.Popen(
+                    ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{width}x{height}",
+                     '-r', str(self.fps), '-i', '-', '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+                     os.path.join(self.directory, f"episode_{eps:06d}.mp4")],
+                    stdin=subprocess.PIPE)
+        if self.export_format == 'png':
+            pygame.image.save(surface, os.path.join(self.directory, f"episode_{eps:06d}", f"{self.frame:05d}.png"))
+        else:
+            self.ffmpeg.stdin.write(pygame.image.tobytes(surface, 'RGB'))
+        self.frame += 1
+
+    def _finish(self):
+        if self.ffmpeg is not None:
+            self.ffmpeg.stdin.close()
+            self.ffmpeg.wait()
+            self.ffmpeg = None
+
+    def close(self):
+        self._finish()
+
+
+def display_worker(frames, fps):
+    '''
+    Body of the display process: shows the frames it gets from the frames queue, paced at fps, until it gets None.
+    Closing the window ends the process, the training process notices and stops sending frames.
+    '''
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("DodgeSquareUltra - training")
+    font = pygame.font.Font(None, 25)
+    action_text = ScrollingText(pygame.font.Font(None, 40), screen)
+    clock = pygame.time.Clock()
+    try:
+        while True:
+            if any(event.type == pygame.QUIT for event in pygame.event.get()):
+                break
+            try:
+                frame = frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if frame is None:
+                break
+            draw_frame(screen, frame, font, action_text)
+            pygame.display.flip()
+            clock.tick(fps)
+    finally:
+        pygame.quit()
+
+
+def export_worker(episodes, fps, export_dir, export_format):
+    '''
+    Body of the export process: draws every frame of the (eps, frames) episodes it gets offscreen and writes them
+    with an EpisodeExporter, until it gets None.
+    '''
+    pygame.font.init()
+    screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    font = pygame.font.Font(None, 25)
+    exporter = EpisodeExporter(export_dir, export_format, fps)
+    try:
+        while True:
+            episode = episodes.get()
+            if episode is None:
+                break
+            eps, frames = episode
+            action_text = ScrollingText(pygame.font.Font(None, 40), screen) #Every video starts with an empty log
+            for frame in frames:
+                draw_frame(screen, frame, font, action_text)
+                exporter.add(eps, screen)
+    finally:
+        exporter.close()
+        pygame.quit()
+
+
+class AsyncTrainingRenderer:
+    '''
+    TrainingRenderer that draws in other processes, so the training loop never waits on the display or the encoding.
+    - display: show the episodes in a window. draw() puts every frame in a queue of queue_size frames and drops it
+      when the queue is full, so the window skips frames when it falls behind.
+    - fps: pace of the window, and frame rate of the exported videos.
+    - export_dir, export_format: write the episodes to disk, check EpisodeExporter. The frames of an episode are
+      collected and handed over whole, to a queue of export_queue_size episodes, so an episode is either exported
+      complete or skipped whole when the exporter is behind. The skipped ones are listed in skipped_episodes, and in
+      <export_dir>/skipped_episodes.txt.
+    Call close() once training is done, it waits for the queued frames and episodes to be drawn.
+    '''
+    def __init__(self, display = True, fps = TICK_RATE, export_dir = None, export_format = 'png',
+                 queue_size = FRAME_QUEUE_SIZE, export_queue_size = EPISODE_QUEUE_SIZE):
+        if export_dir is not None:
+            check_export_format(export_format) #Fail here rather than in the export process
+        context = mp.get_context('spawn')
+        self.display = None
+        self.exporter = None
+        if display:
+            self.frames = context.Queue(queue_size)
+            self.display = context.Process(target=display_worker, args=(self.frames, fps), daemon=True)
+            self.display.start()
+        if export_dir is not None:
+            self.export_dir = export_dir
+            self.episodes = context.Queue(export_queue_size)
+            self.exporter = context.Process(target=export_worker, args=(self.episodes, fps, export_dir, export_format),
+                                            daemon=True)
+            self.exporter.start()
+        self.episode = None #(eps, frames) of the episode being collected for the export
+        self.sent = 0
+        self.dropped = 0
+        self.exported_episodes = []
+        self.skipped_episodes = []
+
+    def poll(self):
+        if self.display is not None and not self.display.is_alive(): #The window was closed
+            self.display = None
+        if self.exporter is not None and not self.exporter.is_alive():
+            raise RuntimeError(f"Episode export process died (exit code {self.exporter.exitcode})")
+
+    def draw(self, eps, player, enemies, metrics, action_name):
+        if self.display is None and self.exporter is None:
+            return
+        frame = frame_snapshot(eps, player, enemies, metrics, action_name)
+        if self.display is not None:
+            try:
+                self.frames.put_nowait(frame)
+                self.sent += 1
+            except queue.Full:
+                self.dropped += 1
+        if self.exporter is not None:
+            if self.episode is None or self.episode[0] != eps:
+                self._send_episode()
+                self.episode = (eps, [])
+            self.episode[1].append(frame)
+
+    def _send_episode(self, block = False):
+        if self.episode is None:
+            return
+        try:
+            self.episodes.put(self.episode, block=block)
+            self.exported_episodes.append(self.episode[0])
+        except queue.Full:
+            self.skipped_episodes.append(self.episode[0])
+        self.episode = None
+
+    def close(self):
+        if self.display is not None:
+            self.frames.put(None)
+            self.display.join()
+        if self.exporter is not None:
+            self._send_episode(block=True) #Training is over, the last episode can wait for room
+            self.episodes.put(None)
+            self.exporter.join()
+            if self.skipped_episodes:
+                with open(os.path.join(self.export_dir, 'skipped_episodes.txt'), 'w') as f:
+                    f.write(''.join(f"{eps}\n" for eps in self.skipped_episodes))
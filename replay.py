@@ -0,0 +1,559 @@
+import os
+import json
+from collections import deque
+import numpy as np
+import torch
+
+'''
+Replay memory for the agent.
+'''
+
+FLUSH_EVERY = 10_000 #Transitions a MappedReplayBuffer adds between two flushes of its counters
+
+class ReplayBuffer:
+    '''
+    Ring buffer backed by preallocated contiguous arrays, one per field of an experience.
+    Once full, the oldest experiences are overwritten.
+    '''
+    def __init__(self, capacity, obs_size = 42, seed = None):
+        self.capacity = capacity
+        self.obs_size = obs_size
+        self.states = np.zeros((capacity, obs_size), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.uint8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, obs_size), dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.bool_)
+        self.index = 0 #Next position to write
+        self.size = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, next_state, done):
+        '''
+        Stores a single experience.
+        '''
+        i = self.index
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+        self.index = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        '''
+        Stores many experiences at once, wrapping around the end of the buffer if needed.
+        '''
+        n = len(states)
+        if n > self.capacity: #Only the newest ones would survive anyway
+            states, actions, rewards, next_states, dones = (a[-self.capacity:] for a in (states, actions, rewards, next_states, dones))
+            n = self.capacity
+        idx = (self.index + np.arange(n)) % self.capacity
+        self.states[idx] = states
+        self.actions[idx] = actions
+        self.rewards[idx] = rewards
+        self.next_states[idx] = next_states
+        self.dones[idx] = dones
+        self.index = (self.index + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def sample_indices(self, batch_size):
+        return self.rng.integers(0, self.size, batch_size)
+
+    def sample(self, batch_size):
+        '''
+        Samples a batch uniformly (with replacement) and returns it as tensors:
+        (states, actions, rewards, next_states, dones). The tensors share memory with the gathered arrays.
+        '''
+        idx = self.sample_indices(batch_size)
+        return self.gather(idx)
+
+    def state_dict(self):
+        '''
+        Contents of the buffer, only the filled part of the arrays is included.
+        '''
+        n = self.size
+        return {
+            'capacity': self.capacity,
+            'index': self.index,
+            'size': self.size,
+            'states': self.states[:n].copy(),
+            'actions': self.actions[:n].copy(),
+            'rewards': self.rewards[:n].copy(),
+            'next_states': self.next_states[:n].copy(),
+            'dones': self.dones[:n].copy(),
+            'rng': self.rng.bit_generator.state,
+        }
+
+    def load_state_dict(self, state):
+        if state['capacity'] != self.capacity or state['states'].shape[1] != self.obs_size:
+            raise ValueError(f"Replay buffer of capacity {state['capacity']} can't be loaded into one of capacity {self.capacity}")
+        n = state['size']
+        self.states[:n] = state['states']
+        self.actions[:n] = state['actions']
+        self.rewards[:n] = state['rewards']
+        self.next_states[:n] = state['next_states']
+        self.dones[:n] = state['dones']
+        self.index = state['index']
+        self.size = n
+        self.rng.bit_generator.state = state['rng']
+
+    def gather(self, idx):
+        return (torch.from_numpy(self.states[idx]),
+                torch.from_numpy(self.actions[idx]),
+                torch.from_numpy(self.rewards[idx]),
+                torch.from_numpy(self.next_states[idx]),
+                torch.from_numpy(self.dones[idx]))
+
+
+class MappedReplayBuffer:
+    '''
+    Replay buffer kept on disk in memory-mapped .npy files, for capacities that don't fit in RAM: only the pages being
+    written and sampled stay resident. It has the same interface as ReplayBuffer, plus:
+    - every observation is stored once: the transitions hold the ids of their state and next_state, and a state equal
+      to the next_state of the same row of the previous add (the same game one step later) reuses its id,
+    - observations can be compacted to float16 (they're normalized to about [-1, 1]),
+    - batches are drawn as runs of sample_chunk consecutive transitions, read in file order, so a batch touches a few
+      pages instead of batch_size random ones,
+    - MappedReplayBuffer.open() maps an existing buffer read-only, which any number of processes can do at once.
+    Observations live in a ring of obs_capacity slots. Transitions whose observations got overwritten are dropped, so
+    when the games are short, fewer than capacity transitions may be live.
+    Files in path: meta.json (settings and counters), observations.npy, state_ids.npy, next_ids.npy, actions.npy,
+    rewards.npy and dones.npy. Readers, or a buffer reopened after a crash, only see what the writer flushed: it
+    does so every flush_every transitions, on checkpoints and on close().
+    Readers don't evict anything, so while the writer is open they skip the oldest transitions, the ones it may have
+    overwritten (or whose observations it may have) since its last flush. That only holds if they refresh() at least
+    once every flush_every transitions of the writer.
+    '''
+    ARRAYS = ('observations', 'state_ids', 'next_ids', 'actions', 'rewards', 'dones')
+
+    def __init__(self, path, capacity = 1_000_000, obs_size = 42, obs_dtype = 'float32', obs_capacity = None,
+                 sample_chunk = 8, seed = None, readonly = False, flush_every = FLUSH_EVERY):
+        if flush_every < 1:
+            raise ValueError(f"flush_every must be at least 1, got {flush_every}")
+        self.path = path
+        self.readonly = readonly
+        self.sample_chunk = sample_chunk
+        self.unflushed = 0 #Transitions added since the last flush
+        self.rng = np.random.default_rng(seed)
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path): #Reopening keeps the settings the buffer was created with
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['obs_size'] != obs_size:
+                raise ValueError(f"Replay buffer in {path} holds observations of size {meta['obs_size']}, not {obs_size}")
+            mode = 'r' if readonly else 'r+'
+            arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode) for name in self.ARRAYS}
+        else:
+            if readonly:
+                raise ValueError(f"No replay buffer in {path}")
+            if obs_capacity is None:
+                obs_capacity = capacity + capacity // 8 #Room for the first state of every game
+            meta = {'capacity': capacity, 'obs_capacity': obs_capacity, 'obs_size': obs_size, 'obs_dtype': obs_dtype,
+                    'index': 0, 'size': 0, 'obs_count': 0, 'max_rows': 1, 'flush_every': flush_every, 'writing': True}
+            os.makedirs(path, exist_ok=True)
+            shapes = {
+                'observations': (np.dtype(obs_dtype), (obs_capacity, obs_size)),
+                'state_ids': (np.int64, (capacity,)),
+                'next_ids': (np.int64, (capacity,)),
+                'actions': (np.uint8, (capacity,)),
+                'rewards': (np.float32, (capacity,)),
+                'dones': (np.bool_, (capacity,)),
+            }
+            arrays = {name: np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode='w+', dtype=dtype, shape=shape)
+                      for name, (dtype, shape) in shapes.items()}
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.capacity = meta['capacity']
+        self.obs_capacity = meta['obs_capacity']
+        self.obs_size = meta['obs_size']
+        self.obs_dtype = meta['obs_dtype']
+        self.flush_every = flush_every
+        self._load_counters(meta)
+        if not readonly:
+            self.writing = True
+            self.flush()
+
+        #The next_states of the last add, to spot the states that were already stored
+        self.last_next = None
+        self.last_next_ids = None
+        self.last_dones = None
+
+    @classmethod
+    def open(cls, path, sample_chunk = 8, seed = None):
+        '''
+        Maps the buffer at path read-only, for sampling from another process. Call refresh() to see newer transitions.
+        '''
+        with open(os.path.join(path, 'meta.json')) as f:
+            obs_size = json.load(f)['obs_size']
+        return cls(path, obs_size=obs_size, sample_chunk=sample_chunk, seed=seed, readonly=True)
+
+    def __len__(self):
+        return self.size
+
+    def _load_counters(self, meta):
+        self.index = meta['index'] #Next transition slot to write
+        self.size = meta['size']
+        self.obs_count = meta['obs_count'] #Observations written so far, the id of the next one
+        self.max_rows = meta['max_rows'] #Most rows added at once, bounds how far back a reused state can be
+        self.writing = meta.get('writing', False) #Whether a writer has the buffer open (or crashed with it open)
+        if self.readonly:
+            self.flush_every = meta.get('flush_every', self.flush_every)
+
+    def refresh(self):
+        '''
+        Re-reads the counters flushed by the writer.
+        '''
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            self._load_counters(json.load(f))
+
+    def flush(self):
+        '''
+        Writes the arrays and then the counters to disk, readers only see the transitions flushed so far.
+        '''
+        for name in self.ARRAYS:
+            getattr(self, name).flush()
+        meta = {'capacity': self.capacity, 'obs_capacity': self.obs_capacity, 'obs_size': self.obs_size,
+                'obs_dtype': self.obs_dtype, 'index': self.index, 'size': self.size, 'obs_count': self.obs_count,
+                'max_rows': self.max_rows, 'flush_every': self.flush_every, 'writing': self.writing}
+        tmp_path = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+        self.unflushed = 0
+
+    def close(self):
+        if not self.readonly:
+            self.writing = False
+            self.flush()
+
+    def _write_observations(self, observations):
+        n = len(observations)
+        ids = self.obs_count + np.arange(n)
+        self.observations[ids % self.obs_capacity] = observations
+        self.obs_count += n
+        return ids
+
+    def add(self, state, action, reward, next_state, done):
+        '''
+        Stores a single experience.
+        '''
+        self.add_batch(np.asarray(state)[None], np.array([action]), np.array([reward]), np.asarray(next_state)[None],
+                       np.array([done]))
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        '''
+        Stores many experiences at once. Feed the games in the same rows every time, one step at a time, for the
+        states to be de-duplicated.
+        '''
+        if self.readonly:
+            raise ValueError(f"Replay buffer in {self.path} was opened read-only")
+        #Big batches are split so a reused state id can never be overwritten while its transition is live, see _evict
+        limit = max(1, min(self.capacity, self.obs_capacity // 16))
+        if len(states) > limit:
+            for start in range(0, len(states), limit):
+                end = start + limit
+                self.add_batch(states[start:end], actions[start:end], rewards[start:end], next_states[start:end], dones[start:end])
+            return
+
+        n = len(states)
+        states = np.asarray(states, dtype=np.float32)
+        next_states = np.asarray(next_states, dtype=np.float32)
+        dones = np.asarray(dones, dtype=np.bool_)
+        self.max_rows = max(self.max_rows, n)
+
+        state_ids = np.empty(n, dtype=np.int64)
+        reused = np.zeros(n, dtype=np.bool_)
+        if self.last_next is not None and len(self.last_next) == n:
+            reused = ~self.last_dones & np.all(states == self.last_next, axis=1)
+            state_ids[reused] = self.last_next_ids[reused]
+        fresh = ~reused
+        state_ids[fresh] = self._write_observations(states[fresh])
+        next_ids = self._write_observations(next_states)
+        self.last_next = next_states.copy() #The caller may reuse its buffers
+        self.last_next_ids = next_ids
+        self.last_dones = dones.copy()
+
+        idx = (self.index + np.arange(n)) % self.capacity
+        self.state_ids[idx] = state_ids
+        self.next_ids[idx] = next_ids
+        self.actions[idx] = actions
+        self.rewards[idx] = rewards
+        self.dones[idx] = dones
+        self.index = (self.index + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        self._evict()
+        self.unflushed += n
+        if self.unflushed >= self.flush_every:
+            self.flush()
+
+    def _evict(self):
+        '''
+        Drops the oldest transitions until none of the live ones refers to an overwritten observation.
+        next ids grow with the transitions, and a state is never more than 3 * max_rows ids older than its next_state
+        (it's either stored in the same add or reused from the previous one), so checking the oldest next id is enough.
+        '''
+        lowest = self.obs_count - self.obs_capacity + 3 * self.max_rows
+        while self.size > 0 and self.next_ids[(self.index - self.size) % self.capacity] < lowest:
+            self.size -= 1
+
+    def _safe_start(self):
+        '''
+        Index of the oldest transition (counted from the oldest live one) that is safe to read. The writer reads
+        everything, readers skip what the writer may have overwritten since its last flush, check the class docstring.
+        '''
+        if not (self.readonly and self.writing):
+            return 0
+        lag = self.flush_every + self.max_rows #Transitions the writer may have added since it flushed
+        start = max(0, self.size + lag - self.capacity)
+        #Every transition writes at most 2 observations, and the next ids grow with the transitions
+        lowest = self.obs_count + 2 * lag - self.obs_capacity + 3 * self.max_rows
+        oldest = self.index - self.size
+        end = self.size
+        while start < end:
+            middle = (start + end) // 2
+            if self.next_ids[(oldest + middle) % self.capacity] < lowest:
+                start = middle + 1
+            else:
+                end = middle
+        return start
+
+    def sample_indices(self, batch_size):
+        start = self._safe_start()
+        live = self.size - start
+        if live <= 0:
+            raise ValueError(f"Nothing safe to sample in {self.path} yet, the writer may have overwritten all of it")
+        chunk = min(self.sample_chunk, live)
+        n_chunks = -(-batch_size // chunk)
+        starts = self.rng.integers(start, self.size - chunk + 1, n_chunks)
+        logical = (starts[:, None] + np.arange(chunk)).ravel()[:batch_size]
+        return np.sort((self.index - self.size + logical) % self.capacity) #In file order, the batch order doesn't matter
+
+    def sample(self, batch_size):
+        '''
+        Samples a batch and returns it as tensors: (states, actions, rewards, next_states, dones).
+        The observations always come back as float32.
+        '''
+        return self.gather(self.sample_indices(batch_size))
+
+    def gather(self, idx):
+        states = self.observations[self.state_ids[idx] % self.obs_capacity].astype(np.float32)
+        next_states = self.observations[self.next_ids[idx] % self.obs_capacity].astype(np.float32)
+        return (torch.from_numpy(states),
+                torch.from_numpy(self.actions[idx]),
+                torch.from_numpy(self.rewards[idx]),
+                torch.from_numpy(next_states),
+                torch.from_numpy(self.dones[idx]))
+
+    def state_dict(self):
+        '''
+        The transitions are on disk already, so a checkpoint only records where, and the sampling RNG.
+        Resuming reopens the directory as it is, with whatever was added after the checkpoint.
+        '''
+        self.flush()
+        return {'path': self.path, 'rng': self.rng.bit_generator.state}
+
+    def load_state_dict(self, state):
+        if os.path.abspath(state['path']) != os.path.abspath(self.path):
+            raise ValueError(f"Checkpoint replay buffer is in {state['path']}, not {self.path}")
+        self.rng.bit_generator.state = state['rng']
+
+
+class NStepBuffer:
+    '''
+    Turns the transitions of one game into n-step transitions as they're stored: the reward of a stored transition is
+    the discounted sum of the next n rewards and its next_state is the state n steps later, so the target only has to
+    bootstrap with gamma ** n. When the episode ends, the transitions still waiting are flushed with shorter returns.
+    '''
+    def __init__(self, n_step, gamma):
+        self.n_step = n_step
+        self.gamma = gamma
+        self.pending = deque()
+
+    def add(self, state, action, reward, next_state, done):
+        '''
+        Returns the n-step transitions completed by this one, as (state, action, reward, next_state, done) tuples.
+        '''
+        self.pending.append((state.copy(), action, reward)) #The state buffer might be reused by the caller
+        completed = []
+        if done:
+            while self.pending:
+                completed.append(self._pop(next_state, True))
+        elif len(self.pending) == self.n_step:
+            completed.append(self._pop(next_state, False))
+        return completed
+
+    def _pop(self, next_state, done):
+        ret = 0.0
+        for i, (_, _, reward) in enumerate(self.pending):
+            ret += self.gamma ** i * reward
+        state, action, _ = self.pending.popleft()
+        return state, action, ret, next_state, done
+
+    def clear(self):
+        self.pending.clear()
+
+
+class VecNStepBuffer:
+    '''
+    NStepBuffer for n_envs games stepped together, fed one time step of all the games at a time.
+    '''
+    def __init__(self, n_step, gamma, n_envs, obs_size):
+        self.n_step = n_step
+        self.discounts = gamma ** np.arange(n_step)
+        self.states = np.zeros((n_step, n_envs, obs_size), dtype=np.float32)
+        self.actions = np.zeros((n_step, n_envs), dtype=np.uint8)
+        self.rewards = np.zeros((n_step, n_envs), dtype=np.float64)
+        self.length = np.zeros(n_envs, dtype=np.int64) #Transitions waiting in every game
+        self.t = 0 #Slot written by the next add, the same for every game
+
+    def add(self, states, actions, rewards, next_states, dones):
+        '''
+        Returns the completed n-step transitions as arrays (states, actions, rewards, next_states, dones).
+        '''
+        n = self.n_step
+        p = self.t
+        self.t = (p + 1) % n
+        self.states[p] = states
+        self.actions[p] = actions
+        self.rewards[p] = rewards
+        self.length = np.minimum(self.length + 1, n)
+
+        #Games with a full window hand out their oldest transition
+        full = np.nonzero((self.length == n) & ~dones)[0]
+        order = (p + 1 + np.arange(n)) % n #Oldest to newest
+        out_states = [self.states[order[0], full]]
+        out_actions = [self.actions[order[0], full]]
+        out_rewards = [self.discounts @ self.rewards[order][:, full]]
+        out_next_states = [next_states[full]]
+        out_dones = [np.zeros(len(full), dtype=np.bool_)]
+
+        #Finished games flush everything they hold
+        for e in np.nonzero(dones)[0]:
+            k = self.length[e]
+            window = (p - k + 1 + np.arange(k)) % n
+            rewards_e = self.rewards[window, e]
+            out_states.append(self.states[window, e])
+            out_actions.append(self.actions[window, e])
+            out_rewards.append(np.array([self.discounts[:k - j] @ rewards_e[j:] for j in range(k)]))
+            out_next_states.append(np.repeat(next_states[e][None], k, axis=0))
+            out_dones.append(np.ones(k, dtype=np.bool_))
+        self.length[dones] = 0
+
+        return (np.concatenate(out_states), np.concatenate(out_actions), np.concatenate(out_rewards),
+                np.concatenate(out_next_states), np.concatenate(out_dones))
+
+
+class SumTree:
+    '''
+    Binary tree stored in a flat array where every node holds the sum of its children.
+    The leaves are the priorities, so sampling proportionally to priority and updating one are both O(log n).
+    '''
+    def __init__(self, capacity):
+        self.n_leaves = 1
+        while self.n_leaves < capacity:
+            self.n_leaves *= 2
+        self.depth = self.n_leaves.bit_length() - 1
+        self.tree = np.zeros(2 * self.n_leaves, dtype=np.float64) #Node 1 is the root, the leaves start at n_leaves
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, idx):
+        return self.tree[idx + self.n_leaves]
+
+    def update(self, idx, priorities):
+        '''
+        Sets the priorities of the leaves idx (an array) and propagates the change up, one level at a time for the whole batch.
+        '''
+        nodes = np.asarray(idx) + self.n_leaves
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        '''
+        Returns the leaf index where each cumulative value falls.
+        '''
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sum = self.tree[left]
+            go_right = values >= left_sum
+            values = np.where(go_right, values - left_sum, values)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self.n_leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    '''
+    Replay buffer that samples experiences proportionally to priority ** alpha, with the priorities kept in a SumTree.
+    Rare big events like collisions keep a large TD error for longer, so they get replayed a lot more often than
+    uneventful frames. sample() also returns the importance-sampling weights to correct for that bias.
+    '''
+    def __init__(self, capacity, obs_size = 42, alpha = 0.6, beta = 0.4, beta_increment = 1e-5, priority_eps = 1e-3, seed = None):
+        super(PrioritizedReplayBuffer, self).__init__(capacity, obs_size, seed)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment #beta is annealed towards 1 on every sample
+        self.priority_eps = priority_eps #Keeps every experience with a non-zero chance of being sampled
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def add(self, state, action, reward, next_state, done):
+        i = self.index
+        super(PrioritizedReplayBuffer, self).add(state, action, reward, next_state, done)
+        self.tree.update(np.array([i]), self.max_priority ** self.alpha) #New experiences get the highest priority seen so far
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        n = min(len(states), self.capacity)
+        idx = (self.index + np.arange(n)) % self.capacity
+        super(PrioritizedReplayBuffer, self).add_batch(states, actions, rewards, next_states, dones)
+        self.tree.update(idx, self.max_priority ** self.alpha)
+
+    def sample_indices(self, batch_size):
+        #Stratified sampling: one value from each of batch_size equal segments of the total priority
+        total = self.tree.total()
+        segment = total / batch_size
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+        idx = self.tree.find(np.minimum(values, np.nextafter(total, 0)))
+        return np.minimum(idx, self.size - 1)
+
+    def sample(self, batch_size):
+        '''
+        Like ReplayBuffer.sample, plus the importance-sampling weights (as a tensor) and the sampled indices,
+        which are needed to update the priorities afterwards.
+        '''
+        idx = self.sample_indices(batch_size)
+        probs = self.tree.get(idx) / self.tree.total()
+        weights = (self.size * probs) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return self.gather(idx) + (torch.from_numpy(weights.astype(np.float32)), idx)
+
+    def state_dict(self):
+        state = super(PrioritizedReplayBuffer, self).state_dict()
+        state['priorities'] = self.tree.get(np.arange(self.size)).copy()
+        state['max_priority'] = self.max_priority
+        state['beta'] = self.beta
+        return state
+
+    def load_state_dict(self, state):
+        super(PrioritizedReplayBuffer, self).load_state_dict(state)
+        self.tree = SumTree(self.capacity)
+        self.tree.update(np.arange(self.size), state['priorities'])
+        self.max_priority = state['max_priority']
+        self.beta = state['beta']
+
+    def update_priorities(self, idx, td_errors):
+        '''
+        Sets the priorities of a sampled batch from the absolute TD errors of its experiences.
+        '''
+        priorities = np.abs(td_errors) + self.priority_eps
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(idx, priorities ** self.alpha)
@@ -0,0 +1,241 @@
+import time
+import queue
+import contextlib
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import torch
+from agent import build_q_network
+from policy import Policy
+from vec_env import VecEnv
+
+'''
+Multi-process experience collection.
+Every worker process runs its own VecEnv and acts with a local copy of the q network. Transitions travel back to
+the learner through shared-memory slots: only the (worker, slot) indices go through the queues, never the arrays.
+The learner publishes fresh weights into another shared-memory block that the workers pull from.
+'''
+
+WORKER_CHECK_INTERVAL = 1.0 #Seconds between two checks that the workers are alive, while waiting for a rollout
+
+
+class SharedArray:
+    '''
+    NumPy array living in a multiprocessing.shared_memory block, so it can be opened by name from another process.
+    '''
+    def __init__(self, shape, dtype, name = None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(create=self.owner, size=size, name=name)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def spec(self):
+        '''
+        What another process needs to open the same array.
+        '''
+        return (self.shape, self.dtype.str, self.shm.name)
+
+    @classmethod
+    def attach(cls, spec):
+        shape, dtype, name = spec
+        return cls(shape, dtype, name)
+
+    def close(self):
+        del self.array
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _slot_layout(n_workers, n_slots, rollout_length, n_envs, obs_size):
+    base = (n_workers, n_slots, rollout_length, n_envs)
+    return {
+        'states': (base + (obs_size,), np.float32),
+        'actions': (base, np.uint8),
+        'rewards': (base, np.float32),
+        'next_states': (base + (obs_size,), np.float32),
+        'dones': (base, np.bool_),
+        'episode_rewards': (base, np.float32), #Return of the finished episode, only meaningful where dones is True
+    }
+
+
+def _load_weights(network, flat):
+    torch.nn.utils.vector_to_parameters(torch.from_numpy(flat), network.parameters())
+
+
+def rollout_worker(worker_id, specs, weights_spec, weights_version, weights_lock, eps, free_slots, full_slots,
+                   stop, running, rollout_length, n_envs, n_actions, observation, seed):
+    '''
+    Worker process: steps its environments with the latest published weights and fills the slots it is given.
+    It finishes the rollout it is on and then waits while running is cleared.
+    '''
+    torch.set_num_threads(1)
+    buffers = {key: SharedArray.attach(spec) for key, spec in specs.items()}
+    weights = SharedArray.attach(weights_spec)
+    arrays = {key: buf.array for key, buf in buffers.items()}
+
+    env = VecEnv(n_envs, seed=seed, observation=observation)
+    network = build_q_network(n_actions, env.obs_size)
+    policy = Policy(network, max_batch=n_envs)
+    local_version = -1
+    rng = np.random.default_rng(seed)
+    state = env.reset()
+
+    try:
+        while not stop.is_set():
+            if not running.wait(timeout=0.1):
+                continue
+            try:
+                slot = free_slots.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            if weights_version.value != local_version:
+                with weights_lock:
+                    local_version = weights_version.value
+                    flat = weights.array.copy()
+                _load_weights(network, flat)
+
+            for t in range(rollout_length):
+                #Epsilon-Greedy, one decision per environment
+                actions = policy.act_batch(state)
+                explore = rng.random(n_envs) < eps.value
+                actions = np.where(explore, rng.integers(0, n_actions, n_envs), actions)
+
+                next_state, rewards, dones = env.step(actions)
+
+                arrays['states'][worker_id, slot, t] = state
+                arrays['actions'][worker_id, slot, t] = actions
+                arrays['rewards'][worker_id, slot, t] = rewards
+                arrays['next_states'][worker_id, slot, t] = next_state
+                arrays['dones'][worker_id, slot, t] = dones
+                arrays['episode_rewards'][worker_id, slot, t] = env.last_episode_reward
+                state = next_state
+
+            full_slots.put((worker_id, slot))
+    finally:
+        del arrays
+        for buf in buffers.values():
+            buf.close()
+        weights.close()
+
+
+class RolloutPool:
+    '''
+    Starts K rollout workers and hands their transitions to the learner.
+    Every worker owns n_slots slots of rollout_length x envs_per_worker transitions, so it can keep collecting
+    while the learner reads the slots it already filled.
+    '''
+    def __init__(self, agent, n_workers = 4, envs_per_worker = 8, rollout_length = 16, n_slots = 4, seed = 0):
+        self.agent = agent
+        self.n_workers = n_workers
+        self.envs_per_worker = envs_per_worker
+        self.rollout_length = rollout_length
+        self.n_slots = n_slots
+        self.seed = seed
+
+        obs_size = agent.q_network[0].in_features
+        layout = _slot_layout(n_workers, n_slots, rollout_length, envs_per_worker, obs_size)
+        self.buffers = {key: SharedArray(shape, dtype) for key, (shape, dtype) in layout.items()}
+
+        n_params = sum(p.numel() for p in agent.q_network.parameters())
+        self.weights = SharedArray((n_params,), np.float32)
+
+        self.ctx = mp.get_context('spawn')
+        self.weights_version = self.ctx.Value('l', -1, lock=False)
+        self.weights_lock = self.ctx.Lock()
+        self.eps = self.ctx.Value('d', agent.eps, lock=False)
+        self.stop = self.ctx.Event()
+        self.running = self.ctx.Event()
+        self.running.set()
+        self.free_slots = [self.ctx.Queue() for _ in range(n_workers)]
+        self.full_slots = self.ctx.Queue()
+        self.workers = []
+
+    def start(self):
+        self.publish_weights()
+        specs = {key: buf.spec() for key, buf in self.buffers.items()}
+        for k in range(self.n_workers):
+            for slot in range(self.n_slots):
+                self.free_slots[k].put(slot)
+            worker = self.ctx.Process(target=rollout_worker, daemon=True,
+                                      args=(k, specs, self.weights.spec(), self.weights_version, self.weights_lock,
+                                            self.eps, self.free_slots[k], self.full_slots, self.stop, self.running,
+                                            self.rollout_length, self.envs_per_worker, self.agent.n_actions,
+                                            self.agent.obs_spec.name, self.seed + k))
+            worker.start()
+            self.workers.append(worker)
+
+    def publish_weights(self):
+        '''
+        Copies the current agent.q_network weights to the workers.
+        '''
+        flat = torch.nn.utils.parameters_to_vector(self.agent.q_network.parameters()).detach().numpy()
+        with self.weights_lock:
+            self.weights.array[:] = flat
+            self.weights_version.value += 1
+
+    @contextlib.contextmanager
+    def paused(self):
+        '''
+        Context manager stopping the workers once they're done with their current rollout, so they don't compete
+        with the learner while it's active (e.g. while it saves a checkpoint).
+        '''
+        self.running.clear()
+        try:
+            yield
+        finally:
+            self.running.set()
+
+    def set_epsilon(self, eps):
+        self.eps.value = eps
+
+    def get(self, timeout = None):
+        '''
+        Waits for a filled slot and returns a copy of its transitions, flattened to one row per transition:
+        (states, actions, rewards, next_states, dones, episode_rewards). The slot goes back to its worker right away.
+        '''
+        k, batch = self.get_rollout(timeout)
+        return tuple(a.reshape(-1, *a.shape[2:]) for a in batch)
+
+    def get_rollout(self, timeout = None):
+        '''
+        Like get(), but keeps the (rollout_length, envs_per_worker) layout and also returns the worker it came from.
+        The rollouts of a worker come out in the order they were played, each one continuing the previous one.
+        Raises RuntimeError if a worker died meanwhile, instead of waiting for it forever.
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = WORKER_CHECK_INTERVAL if deadline is None else min(WORKER_CHECK_INTERVAL, deadline - time.monotonic())
+            try:
+                k, slot = self.full_slots.get(timeout=max(wait, 0))
+                break
+            except queue.Empty:
+                self.check_workers()
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+        batch = tuple(self.buffers[key].array[k, slot].copy()
+                      for key in ('states', 'actions', 'rewards', 'next_states', 'dones', 'episode_rewards'))
+        self.free_slots[k].put(slot)
+        return k, batch
+
+    def check_workers(self):
+        '''
+        Raises RuntimeError if a worker process is gone, e.g. after an exception or an OOM kill.
+        '''
+        for k, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                raise RuntimeError(f"Rollout worker {k} died (exit code {worker.exitcode})")
+
+    def close(self):
+        self.stop.set()
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        for buf in self.buffers.values():
+            buf.close()
+        self.weights.close()
@@ -0,0 +1,133 @@
+import math
+from game import SCREEN_WIDTH, SCREEN_HEIGHT
+
+'''
+Uniform grid broadphase over the arena, so collision and nearest-enemy queries only look at the cells around
+the player instead of every enemy on screen.
+'''
+
+class SpatialHash:
+    '''
+    Spatial hash of entities with a .rect and a .pos. Every entity is registered in the cells its rect covers,
+    and update() only touches the cell buckets when the entity actually changed cells.
+    '''
+    def __init__(self, cell_size = 64, width = SCREEN_WIDTH, height = SCREEN_HEIGHT):
+        self.cell_size = cell_size
+        self.cells = {} #(cx, cy) -> set of entities
+        self.entity_cells = {} #entity -> cells it is registered in
+        #Enemies are dropped soon after leaving the screen, so no search needs to go much further than this
+        self.max_ring = max(width, height) // cell_size + 2
+
+    def __len__(self):
+        return len(self.entity_cells)
+
+    def __contains__(self, entity):
+        return entity in self.entity_cells
+
+    def _cells_for(self, rect):
+        cs = self.cell_size
+        x0 = rect.x // cs
+        y0 = rect.y // cs
+        x1 = (rect.x + rect.width - 1) // cs
+        y1 = (rect.y + rect.height - 1) // cs
+        if x0 == x1 and y0 == y1:
+            return ((x0, y0),)
+        return tuple((cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1))
+
+    def insert(self, entity):
+        keys = self._cells_for(entity.rect)
+        self.entity_cells[entity] = keys
+        for key in keys:
+            bucket = self.cells.get(key)
+            if bucket is None:
+                bucket = self.cells[key] = set()
+            bucket.add(entity)
+
+    def remove(self, entity):
+        keys = self.entity_cells.pop(entity, None)
+        if keys is None:
+            return
+        for key in keys:
+            bucket = self.cells[key]
+            bucket.discard(entity)
+            if not bucket:
+                del self.cells[key]
+
+    def update(self, entity):
+        '''
+        Call after the entity moved.
+        '''
+        keys = self._cells_for(entity.rect)
+        if keys != self.entity_cells.get(entity):
+            self.remove(entity)
+            self.insert(entity)
+
+    def clear(self):
+        self.cells.clear()
+        self.entity_cells.clear()
+
+    def query(self, rect):
+        '''
+        Returns the entities whose rect overlaps rect.
+        '''
+        found = set()
+        for key in self._cells_for(rect):
+            bucket = self.cells.get(key)
+            if bucket:
+                found.update(bucket)
+        return [entity for entity in found if entity.rect.colliderect(rect)]
+
+    def any_overlap(self, rect):
+        '''
+        Does anything overlap rect?
+        '''
+        for key in self._cells_for(rect):
+            bucket = self.cells.get(key)
+            if bucket:
+                for entity in bucket:
+                    if entity.rect.colliderect(rect):
+                        return True
+        return False
+
+    def nearest(self, x, y, k = 1):
+        '''
+        Returns up to k (distance, entity) pairs closest to (x, y), measured to entity.pos, sorted by distance.
+        Searches rings of cells outwards from the cell of (x, y), and stops as soon as no unseen cell can be closer.
+        '''
+        cs = self.cell_size
+        cx = int(x // cs)
+        cy = int(y // cs)
+        seen = set()
+        found = []
+        total = len(self.entity_cells)
+        for r in range(self.max_ring + 1):
+            for key in self._ring(cx, cy, r):
+                bucket = self.cells.get(key)
+                if not bucket:
+                    continue
+                for entity in bucket:
+                    if entity not in seen:
+                        seen.add(entity)
+                        ex, ey = entity.pos
+                        found.append((math.hypot(ex - x, ey - y), entity))
+            if len(seen) == total:
+                break
+            #Anything not seen yet sits at least r cells away from (x, y)
+            if len(found) >= k:
+                found.sort(key=lambda pair: pair[0])
+                if found[k - 1][0] <= r * cs:
+                    break
+        found.sort(key=lambda pair: pair[0])
+        return found[:k]
+
+    @staticmethod
+    def _ring(cx, cy, r):
+        if r == 0:
+            yield (cx, cy)
+            return
+        for dx in range(-r, r + 1):
+            yield (cx + dx, cy - r)
+            yield (cx + dx, cy + r)
+        for dy in range(-r + 1, r):
+            yield (cx - r, cy + dy)
+            yield (cx + r, cy + dy)
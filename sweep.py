@@ -0,0 +1,189 @@
+import os
+import csv
+import json
+import math
+import time
+import random
+import multiprocessing as mp
+from collections import deque
+import numpy as np
+import torch
+import game
+from agent import Agent, seed_everything
+from train import agent_training_loop
+from metrics_log import MetricsLog
+
+'''
+Hyperparameter sweep with early stopping.
+Random configurations are trained headless across a process pool, one trial per core. Weak ones are stopped early,
+ASHA style: every time a trial reaches a rung (min_episodes, then eta times more at every rung), its recent score is
+compared with the scores every other trial had at that rung, and it only goes on if it's in the top 1 / eta of them.
+So most of the budget goes to the promising configurations, and no trial waits for another one.
+
+    python sweep.py --trials 64 --workers 8 --episodes 1000
+
+Every trial plays the same seeded games, so the configurations are compared on equal terms. The results go to
+<output>/results.csv as the trials finish, and every trial's metrics to <output>/trial_<n> (check metrics_log.py).
+The score is the mean episode length (frames survived) over the last window episodes by default: the reward constants
+are part of the search space, so rewards of different trials aren't comparable. --metric reward uses them anyway.
+'''
+
+#name: ('log', low, high), ('uniform', low, high), ('int', low, high) or ('choice', [values])
+SPACE = {
+    'learning_rate': ('log', 1e-4, 3e-3),
+    'gamma': ('uniform', 0.9, 0.995),
+    'eps_decay': ('uniform', 0.98, 0.999),
+    'batch_size': ('choice', [32, 64, 128]),
+    'memory_size': ('choice', [20_000, 100_000]),
+    'target_update_frequency': ('choice', [50, 100, 500]),
+    'border_penalty': ('uniform', 10, 100),
+    'hit_penalty': ('uniform', 50, 300),
+    'distance_reward': ('log', 0.001, 0.05),
+}
+AGENT_PARAMS = ('learning_rate', 'gamma', 'eps_decay', 'batch_size', 'memory_size', 'target_update_frequency')
+REWARD_PARAMS = {'border_penalty': 'BORDER_PENALTY', 'hit_penalty': 'HIT_PENALTY', 'distance_reward': 'DISTANCE_REWARD'}
+DEFAULT_REWARDS = {name: getattr(game, constant) for name, constant in REWARD_PARAMS.items()}
+WINDOW = 20 #Episodes averaged into a score
+
+
+def sample_params(space, rng):
+    '''
+    One random configuration out of space, drawn with rng (a random.Random).
+    '''
+    params = {}
+    for name, (kind, *args) in space.items():
+        if kind == 'log':
+            params[name] = math.exp(rng.uniform(math.log(args[0]), math.log(args[1])))
+        elif kind == 'uniform':
+            params[name] = rng.uniform(args[0], args[1])
+        elif kind == 'int':
+            params[name] = rng.randint(args[0], args[1])
+        elif kind == 'choice':
+            params[name] = rng.choice(args[0])
+        else:
+            raise ValueError(f"Unknown kind {kind!r} for {name}, expected log, uniform, int or choice")
+    return params
+
+
+def rungs(min_episodes, max_episodes, eta):
+    '''
+    Episode counts at which the trials get compared: min_episodes, then eta times more every time, below max_episodes.
+    '''
+    result = []
+    episodes = min_episodes
+    while episodes < max_episodes:
+        result.append(episodes)
+        episodes *= eta
+    return result
+
+
+def keep_going(board, lock, rung, score, eta):
+    '''
+    Records score at rung on the board shared by the trials, and tells whether it is in the top 1 / eta of the
+    scores recorded there so far. The first trials to get somewhere always go on.
+    '''
+    with lock:
+        scores = board.get(rung, []) + [score]
+        board[rung] = scores
+    return score >= np.percentile(scores, 100 * (1 - 1 / eta))
+
+
+def run_trial(trial, params, seed, max_episodes, rung_list, eta, metric, window, output, board, lock):
+    '''
+    Trains one configuration until max_episodes or until it gets stopped at a rung. Runs in the pool workers.
+    '''
+    torch.set_num_threads(1) #One trial per core
+    for name, constant in REWARD_PARAMS.items(): #Set them all, the worker may have run another trial before
+        setattr(game, constant, params.get(name, DEFAULT_REWARDS[name]))
+    seed_everything(seed)
+    agent = Agent(seed=seed, **{name: value for name, value in params.items() if name in AGENT_PARAMS})
+
+    recent = deque(maxlen=window)
+    outcome = {'status': 'completed', 'episodes': 0}
+    rung_set = set(rung_list)
+
+    def stop(episode, reward, length):
+        recent.append(reward if metric == 'reward' else length)
+        outcome['episodes'] = episode + 1
+        if episode + 1 in rung_set and not keep_going(board, lock, episode + 1, float(np.mean(recent)), eta):
+            outcome['status'] = 'pruned'
+            return True
+        return False
+
+    log = MetricsLog(os.path.join(output, f"trial_{trial:04d}"))
+    start = time.perf_counter()
+    agent_training_loop(max_episodes, agent=agent, seed=seed, log=log, keep_history=False, stop=stop)
+    log.close()
+    return dict(trial=trial, status=outcome['status'], episodes=outcome['episodes'], score=float(np.mean(recent)),
+                seconds=round(time.perf_counter() - start, 1), **params)
+
+
+def _run_trial(args):
+    return run_trial(*args)
+
+
+def sweep(n_trials = 32, n_workers = None, space = SPACE, max_episodes = 1000, min_episodes = 50, eta = 3,
+          metric = 'length', window = WINDOW, output = 'runs/sweep', seed = 0):
+    '''
+    Runs n_trials random configurations of space and returns their results, best first: the trials that got the
+    furthest, by score, as the scores of earlier rungs come from less trained agents.
+    n_workers defaults to the number of cores.
+    '''
+    if metric not in ('length', 'reward'):
+        raise ValueError(f"metric must be length or reward, got {metric!r}")
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    os.makedirs(output, exist_ok=True)
+    rng = random.Random(seed)
+    configs = [sample_params(space, rng) for _ in range(n_trials)]
+    rung_list = rungs(min_episodes, max_episodes, eta)
+    with open(os.path.join(output, 'sweep.json'), 'w') as f:
+        json.dump({'space': space, 'max_episodes': max_episodes, 'min_episodes': min_episodes, 'eta': eta,
+                   'rungs': rung_list, 'metric': metric, 'window': window, 'seed': seed}, f, indent=2)
+
+    context = mp.get_context('spawn')
+    results = []
+    with context.Manager() as manager, context.Pool(n_workers) as pool, \
+            open(os.path.join(output, 'results.csv'), 'w', newline='') as f:
+        board = manager.dict()
+        lock = manager.Lock()
+        writer = csv.DictWriter(f, fieldnames=['trial', 'status', 'episodes', 'score', 'seconds'] + list(space))
+        writer.writeheader()
+        jobs = [(trial, params, seed, max_episodes, rung_list, eta, metric, window, output, board, lock)
+                for trial, params in enumerate(configs)]
+        for row in pool.imap_unordered(_run_trial, jobs):
+            writer.writerow(row)
+            f.flush()
+            results.append(row)
+            print(f"[{len(results)}/{n_trials}] trial {row['trial']} {row['status']} after {row['episodes']} episodes, "
+                  f"score {row['score']:.2f}")
+    results.sort(key=lambda row: (row['episodes'], row['score']), reverse=True)
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Random hyperparameter sweep with ASHA-style early stopping.')
+    parser.add_argument('--trials', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=None, help='Trials trained at once, the number of cores by default.')
+    parser.add_argument('--episodes', type=int, default=1000, help='Episodes of the trials that are never stopped.')
+    parser.add_argument('--min-episodes', type=int, default=50, help='First rung, where the weakest trials get stopped.')
+    parser.add_argument('--eta', type=int, default=3, help='Only the top 1/eta of the trials go on at every rung.')
+    parser.add_argument('--metric', choices=['length', 'reward'], default='length')
+    parser.add_argument('--window', type=int, default=WINDOW, help='Episodes averaged into a score.')
+    parser.add_argument('--space', help='JSON file with the search space, in the format of sweep.SPACE.')
+    parser.add_argument('--output', default=None, help='Results directory, runs/sweep-<timestamp> by default.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    space = SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+    output = args.output or os.path.join('runs', time.strftime('sweep-%Y%m%d-%H%M%S'))
+    results = sweep(args.trials, args.workers, space, args.episodes, args.min_episodes, args.eta, args.metric,
+                    args.window, output, args.seed)
+    print(f"Best configurations ({output}/results.csv):")
+    for row in results[:5]:
+        params = ', '.join(f"{name}={row[name]:.4g}" if isinstance(row[name], float) else f"{name}={row[name]}" for name in space)
+        print(f"  trial {row['trial']}: score {row['score']:.2f} ({row['status']}, {row['episodes']} episodes) {params}")
@@ -0,0 +1,27 @@
+import random
+from game import Player, EnemyPool, advance
+
+'''
+Checks of the game core.
+'''
+
+
+def test_enemy_pool_keeps_spawn_order():
+    #The absolute observation lists the enemies in pool order, which has to be spawn order like in vec_env.VecEnv
+    rng = random.Random(0)
+    actions = random.Random(1)
+    player = Player()
+    player.hp = 10**6 #Long enough for plenty of removals
+    enemies = EnemyPool(20)
+    expected = []
+    frames_passed = 0
+    removals = 0
+    for _ in range(5000):
+        state, reward, done, frames_passed = advance(player, actions.randrange(8), enemies, 20, frames_passed, rng=rng)
+        live = set(map(id, enemies))
+        removals += sum(id(enemy) not in live for enemy in expected)
+        expected = [enemy for enemy in expected if id(enemy) in live]
+        expected += [enemy for enemy in enemies if enemy not in expected]
+        assert list(enemies) == expected
+        assert [enemy.slot for enemy in enemies] == list(range(len(enemies)))
+    assert removals > 50
@@ -0,0 +1,157 @@
+import numpy as np
+from replay import SumTree, PrioritizedReplayBuffer, MappedReplayBuffer, NStepBuffer, VecNStepBuffer
+
+'''
+Checks of the replay structures against plain reference implementations.
+'''
+
+
+def test_sum_tree_find_matches_cumulative_sum():
+    rng = np.random.default_rng(0)
+    tree = SumTree(37) #Not a power of two, so the last leaves are padding
+    priorities = rng.random(37) + 0.01
+    tree.update(np.arange(37), priorities)
+    assert np.isclose(tree.total(), priorities.sum())
+
+    values = rng.random(1000) * priorities.sum()
+    expected = np.searchsorted(np.cumsum(priorities), values, side='right')
+    assert np.array_equal(tree.find(values), expected)
+
+
+def test_sum_tree_update_keeps_every_node_a_sum():
+    rng = np.random.default_rng(1)
+    tree = SumTree(20)
+    priorities = np.zeros(20)
+    for _ in range(50):
+        idx = rng.choice(20, size=rng.integers(1, 8), replace=False)
+        priorities[idx] = rng.random(len(idx))
+        tree.update(idx, priorities[idx])
+    nodes = np.arange(1, tree.n_leaves)
+    assert np.allclose(tree.tree[nodes], tree.tree[2 * nodes] + tree.tree[2 * nodes + 1])
+    assert np.allclose(tree.get(np.arange(20)), priorities)
+    assert np.isclose(tree.total(), priorities.sum())
+
+
+def test_prioritized_sampling_is_proportional_to_priority():
+    buffer = PrioritizedReplayBuffer(8, obs_size=2, alpha=1.0, seed=0)
+    for i in range(8):
+        buffer.add(np.zeros(2), 0, 0.0, np.zeros(2), False)
+    priorities = np.arange(1, 9, dtype=np.float64)
+    buffer.tree.update(np.arange(8), priorities)
+
+    counts = np.zeros(8)
+    for _ in range(4000):
+        counts += np.bincount(buffer.sample_indices(32), minlength=8)
+    expected = priorities / priorities.sum()
+    assert np.allclose(counts / counts.sum(), expected, atol=0.01)
+
+
+def play_rows(rng, n_envs, n_steps, obs_size, done_rate = 0.1):
+    '''
+    Random games stepped together, one (states, actions, rewards, next_states, dones) time step at a time, where
+    every state is the previous next_state of its game unless that game just ended.
+    '''
+    states = rng.random((n_envs, obs_size), dtype=np.float32)
+    for _ in range(n_steps):
+        next_states = rng.random((n_envs, obs_size), dtype=np.float32)
+        dones = rng.random(n_envs) < done_rate
+        yield states, rng.integers(0, 8, n_envs).astype(np.uint8), rng.random(n_envs), next_states, dones
+        states = np.where(dones[:, None], rng.random((n_envs, obs_size), dtype=np.float32), next_states)
+
+
+def test_vec_n_step_matches_one_n_step_buffer_per_game():
+    rng = np.random.default_rng(2)
+    n_envs, n_step, gamma = 5, 3, 0.9
+    vec = VecNStepBuffer(n_step, gamma, n_envs, 2)
+    singles = [NStepBuffer(n_step, gamma) for _ in range(n_envs)]
+    for t, (states, actions, rewards, next_states, dones) in enumerate(play_rows(rng, n_envs, 300, 2, 0.15)):
+        #Every state is tagged with its game and time step, so the transitions can be matched whatever their order
+        states = np.stack([np.arange(n_envs), np.full(n_envs, t)], axis=1).astype(np.float32)
+        expected = {}
+        for e in range(n_envs):
+            for state, action, reward, next_state, done in singles[e].add(states[e], actions[e], rewards[e],
+                                                                          next_states[e], dones[e]):
+                expected[tuple(state)] = (action, reward, tuple(next_state), done)
+        out_states, out_actions, out_rewards, out_next_states, out_dones = vec.add(states, actions, rewards, next_states, dones)
+        assert len(out_states) == len(expected)
+        for state, action, reward, next_state, done in zip(out_states, out_actions, out_rewards, out_next_states, out_dones):
+            e_action, e_reward, e_next_state, e_done = expected[tuple(state)]
+            assert (action, tuple(next_state), done) == (e_action, e_next_state, e_done)
+            assert np.isclose(reward, e_reward)
+
+
+def check_live_transitions(buffer, reference):
+    '''
+    The live transitions of a MappedReplayBuffer have to be the newest len(buffer) added, with intact observations.
+    '''
+    size = len(buffer)
+    assert 0 < size <= buffer.capacity
+    idx = (buffer.index - size + np.arange(size)) % buffer.capacity
+    states, actions, rewards, next_states, dones = (t.numpy() for t in buffer.gather(idx))
+    ref_states, ref_actions, ref_rewards, ref_next_states, ref_dones = (np.array(a) for a in zip(*reference[-size:]))
+    assert np.array_equal(states, ref_states)
+    assert np.array_equal(next_states, ref_next_states)
+    assert np.array_equal(actions, ref_actions)
+    assert np.allclose(rewards, ref_rewards)
+    assert np.array_equal(dones, ref_dones)
+
+
+def test_mapped_buffer_stays_consistent_under_eviction(tmp_path):
+    rng = np.random.default_rng(3)
+    #Fewer observation slots than transitions, so it's the observation ring that evicts
+    buffer = MappedReplayBuffer(str(tmp_path / 'replay'), capacity=200, obs_size=3, obs_capacity=128, seed=0)
+    reference = []
+    #The row count changes halfway, which breaks the de-duplication chain once
+    for n_envs, n_steps in ((6, 60), (4, 60)):
+        for states, actions, rewards, next_states, dones in play_rows(rng, n_envs, n_steps, 3):
+            buffer.add_batch(states, actions, rewards, next_states, dones)
+            reference.extend(zip(states, actions, rewards.astype(np.float32), next_states, dones))
+            check_live_transitions(buffer, reference)
+    assert len(buffer) < buffer.capacity
+    #The states following a next_state of the same game were stored once
+    assert buffer.obs_count < 2 * len(reference)
+
+    buffer.close()
+    reader = MappedReplayBuffer.open(str(tmp_path / 'replay'))
+    check_live_transitions(reader, reference)
+    states, _, _, next_states, _ = reader.sample(32)
+    assert states.shape == next_states.shape == (32, 3)
+
+
+def test_mapped_buffer_splits_big_batches(tmp_path):
+    rng = np.random.default_rng(4)
+    buffer = MappedReplayBuffer(str(tmp_path / 'replay'), capacity=50, obs_size=2, obs_capacity=64, seed=0)
+    reference = []
+    for states, actions, rewards, next_states, dones in play_rows(rng, 30, 10, 2):
+        buffer.add_batch(states, actions, rewards, next_states, dones)
+        reference.extend(zip(states, actions, rewards.astype(np.float32), next_states, dones))
+        check_live_transitions(buffer, reference)
+
+
+def test_mapped_buffer_reader_follows_a_live_writer(tmp_path):
+    rng = np.random.default_rng(5)
+    path = str(tmp_path / 'replay')
+    writer = MappedReplayBuffer(path, capacity=200, obs_size=3, obs_capacity=128, flush_every=20, seed=0)
+    reader = MappedReplayBuffer.open(path, seed=1)
+    reference = []
+    flushed = 0 #Transitions the writer had added at its last flush
+    seen = 0
+    for t, (states, actions, rewards, next_states, dones) in enumerate(play_rows(rng, 4, 400, 3)):
+        writer.add_batch(states, actions, rewards, next_states, dones)
+        reference.extend(zip(states, actions, rewards.astype(np.float32), next_states, dones))
+        if writer.unflushed == 0:
+            flushed = len(reference)
+        if t % 5 == 0: #At least once every flush_every transitions of the writer
+            reader.refresh()
+            known = flushed
+        if len(reader) == 0:
+            continue
+        #Whatever the writer did since the reader's refresh, what the reader samples is intact
+        idx = reader.sample_indices(16)
+        logical = (idx - (reader.index - reader.size)) % reader.capacity
+        batch_states, _, _, batch_next_states, _ = (a.numpy() for a in reader.gather(idx))
+        for row, position in enumerate(known - reader.size + logical):
+            assert np.array_equal(batch_states[row], reference[position][0])
+            assert np.array_equal(batch_next_states[row], reference[position][3])
+        seen += 1
+    assert seen > 300
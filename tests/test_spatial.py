@@ -0,0 +1,55 @@
+import math
+import numpy as np
+from game import Rect
+from spatial import SpatialHash
+
+'''
+Checks of the spatial hash queries against brute force over every entity.
+'''
+
+
+class Dot:
+    def __init__(self, x, y, size = 20):
+        self.pos = (x, y)
+        self.rect = Rect(int(x) - size // 2, int(y) - size // 2, size, size)
+
+
+def random_dots(rng, n):
+    #Some off screen too, like enemies about to be dropped
+    return [Dot(rng.uniform(-100, 1380), rng.uniform(-100, 820)) for _ in range(n)]
+
+
+def test_nearest_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for n in (0, 1, 5, 40):
+        grid = SpatialHash()
+        dots = random_dots(rng, n)
+        for dot in dots:
+            grid.insert(dot)
+        for _ in range(50):
+            x, y = rng.uniform(-50, 1330), rng.uniform(-50, 770)
+            for k in (1, 3, 50):
+                expected = sorted(math.hypot(dot.pos[0] - x, dot.pos[1] - y) for dot in dots)[:k]
+                found = [dist for dist, _ in grid.nearest(x, y, k)]
+                assert np.allclose(found, expected)
+
+
+def test_query_matches_brute_force_after_updates():
+    rng = np.random.default_rng(1)
+    grid = SpatialHash()
+    dots = random_dots(rng, 60)
+    for dot in dots:
+        grid.insert(dot)
+    for dot in dots[::2]: #Move half of them, some across cells
+        x, y = dot.pos[0] + rng.uniform(-90, 90), dot.pos[1] + rng.uniform(-90, 90)
+        dot.pos = (x, y)
+        dot.rect.x, dot.rect.y = int(x) - 10, int(y) - 10
+        grid.update(dot)
+    for dot in dots[:10]:
+        grid.remove(dot)
+    alive = dots[10:]
+    for _ in range(100):
+        rect = Rect(int(rng.uniform(-100, 1280)), int(rng.uniform(-100, 720)), int(rng.uniform(1, 300)), int(rng.uniform(1, 300)))
+        expected = {id(dot) for dot in alive if dot.rect.colliderect(rect)}
+        assert {id(dot) for dot in grid.query(rect)} == expected
+        assert grid.any_overlap(rect) == bool(expected)
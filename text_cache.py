@@ -0,0 +1,48 @@
+from collections import OrderedDict
+
+'''
+Cache of rendered text surfaces.
+Rasterizing text, the large title fonts especially, is one of the most expensive things done per frame, while
+most of the text on screen doesn't change between frames. render_text() only rasterizes text it hasn't seen recently.
+'''
+
+MAX_ENTRIES = 256
+
+
+class TextCache:
+    '''
+    LRU cache of font.render() results keyed by (font, text, color, antialias).
+    '''
+    def __init__(self, max_entries = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color, antialias = True):
+        key = (font, text, color, antialias)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False) #Evict the least recently used
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+
+
+default_cache = TextCache()
+
+
+def render_text(font, text, color, antialias = True):
+    '''
+    Drop-in replacement for font.render(text, antialias, color) that goes through the shared cache.
+    '''
+    return default_cache.render(font, text, color, antialias)
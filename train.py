@@ -0,0 +1,310 @@
+import os
+import random
+import numpy as np
+from agent import Agent, seed_everything
+from game import MAX_ENEMIES, advance, env_reset, action_map
+from spatial import SpatialHash
+from rollout import RolloutPool
+from replay import VecNStepBuffer, FLUSH_EVERY
+from learner import Learner
+from checkpoint import save_checkpoint, load_checkpoint
+from metrics import Metrics, open_sink
+from metrics_log import MetricsLog
+from observation import SPECS
+from recording import EpisodeRecorder, KIND_AGENT, episode_seed
+
+'''
+Agent training loop. It only depends on the headless game core, so it runs on machines without a display.
+Pass a render.TrainingRenderer to watch the episodes being played, or a render.AsyncTrainingRenderer to draw and
+export them in another process without slowing training down.
+'''
+
+def agent_training_loop(n_episodes = 1000, render_episode = 5, renderer = None, agent = None,
+                        train_every = 1, gradient_steps = 1, batch_size = None, background_learner = False,
+                        n_enemies = MAX_ENEMIES, use_grid = False, action_repeat = 1, coarse_steps = False,
+                        checkpoint = None, checkpoint_every = 50, metrics = None, seed = None, recorder = None,
+                        log = None, keep_history = True, stop = None):
+    '''
+    Main training loop
+    Every train_every decisions, gradient_steps updates are run, on a background thread if background_learner is set.
+    use_grid keeps the enemies in a spatial hash for the collision and closest enemy checks, check game.step: it is
+    slower than the plain loop for now.
+    The agent picks an action once every action_repeat frames, check game.advance for coarse_steps.
+    With a checkpoint path, the run is saved there every checkpoint_every episodes and resumed from it if it already exists.
+    Pass an enabled metrics.Metrics to time every phase of a frame, it's flushed to its sink after every episode.
+    Every episode spawns its enemies from its own random.Random, seeded from seed, and a recording.EpisodeRecorder
+    stores them so they can be replayed.
+    Every finished episode is appended to log (a metrics_log.MetricsLog) when there is one. With keep_history=False the
+    per-episode losses and rewards aren't kept in memory (nor in the checkpoints), so the returned lists are empty.
+    stop(episode, reward, length) is called after every episode, training ends early once it returns True.
+    '''
+    if agent is None:
+        agent = Agent()
+    if metrics is None:
+        metrics = Metrics()
+    metrics.show("Episode", 'episode', f"{{}}/{n_episodes}")
+    metrics.show("Reward", 'reward', "{:.2f}")
+    metrics.show("Avg Loss", 'episode_loss', "{:.4f}")
+    metrics.show("Epsilon", 'eps', "{:.2f}")
+    grid = SpatialHash() if use_grid else None
+    encoder = agent.obs_spec.encoder()
+    eps_losses = []
+    eps_rewards = []
+    start_episode = 0
+    if checkpoint is not None and os.path.exists(checkpoint):
+        last_episode, eps_losses, eps_rewards = load_checkpoint(checkpoint, agent)
+        start_episode = last_episode + 1
+        for loss in eps_losses:
+            metrics.observe('episode_loss', loss)
+    learner = Learner(agent, train_every, gradient_steps, batch_size, background_learner, metrics=metrics).start()
+
+    enemies = None #The EnemyPool, made by the first env_reset and reused by the next ones
+    for eps in range(start_episode, n_episodes):
+        render_current_episode = renderer is not None and (eps % render_episode == 0)
+
+        player, enemies, n_enemies, frames_passed, current_state, reward, done = env_reset(n_enemies, grid, encoder, enemies)
+        game_seed = episode_seed(seed, eps)
+        rng = random.Random(game_seed)
+        if recorder is not None:
+            recorder.begin(game_seed, KIND_AGENT, eps, n_enemies, action_repeat, coarse_steps)
+        eps_loss = []
+        eps_reward = 0
+        eps_decisions = 0
+        eps_epsilon = agent.eps
+        metrics.gauge('episode', eps)
+        metrics.gauge('eps', eps_epsilon)
+
+        while not done:
+
+            if renderer is not None:
+                start = metrics.now()
+                renderer.poll()
+                metrics.record_time('poll', start)
+
+            start = metrics.now()
+            action = agent.select_action(current_state)
+            metrics.record_time('select_action', start)
+
+            start = metrics.now()
+            next_state, reward, done, frames_passed = advance(player, action, enemies, n_enemies, frames_passed, grid,
+                                                              action_repeat, coarse_steps, encoder, rng)
+            metrics.record_time('step', start)
+            if recorder is not None:
+                recorder.record(action, reward, player, enemies)
+
+            learner.remember(current_state, action, reward, next_state, done) #Times 'remember' and 'replay' itself
+
+            current_state = next_state
+            eps_reward += reward
+            eps_decisions += 1
+            eps_loss.extend(learner.drain_losses())
+
+            if render_current_episode:
+                start = metrics.now()
+                metrics.gauge('reward', eps_reward)
+                renderer.draw(eps, player, enemies, metrics, action_map[action])
+                metrics.record_time('render', start)
+
+        agent.decay_epsilon() #Decay eps after every episode
+        if recorder is not None:
+            recorder.end()
+
+        episode_loss = np.mean(eps_loss) if eps_loss else np.nan
+        if eps_loss:
+            metrics.observe('episode_loss', episode_loss)
+            if keep_history:
+                eps_losses.append(episode_loss)
+        if keep_history:
+            eps_rewards.append(eps_reward)
+        if log is not None:
+            log.append(eps, reward=eps_reward, loss=episode_loss, length=eps_decisions, epsilon=eps_epsilon)
+        metrics.observe('episode_reward', eps_reward)
+        metrics.count('episodes')
+        metrics.count('decisions', eps_decisions)
+        metrics.flush(episode=eps)
+
+        if checkpoint is not None and ((eps + 1) % checkpoint_every == 0 or eps == n_episodes - 1):
+            with learner.paused():
+                save_checkpoint(checkpoint, agent, eps, eps_losses, eps_rewards)
+
+        if stop is not None and stop(eps, eps_reward, eps_decisions):
+            break
+
+    learner.stop()
+
+    return eps_losses, eps_rewards
+
+
+def parallel_training_loop(total_steps = 1_000_000, n_workers = 4, envs_per_worker = 8, rollout_length = 16,
+                           updates_per_rollout = 4, publish_every = 50, agent = None, log = None, keep_history = True,
+                           checkpoint = None, checkpoint_every = 50):
+    '''
+    Training loop where n_workers processes collect the experience and this process only learns.
+    Weights are pushed to the workers every publish_every gradient updates.
+    log, keep_history, checkpoint and checkpoint_every work like in agent_training_loop: the run is saved (with the
+    step and episode counters) every time checkpoint_every more episodes are done, and resumed from the checkpoint if
+    it exists. The games the workers were playing and the pending n-step windows start over on a resume.
+    The worker games are seeded from the global random module (check agent.seed_everything), whose state is part of
+    the checkpoint, so a resumed run goes on with new games.
+    '''
+    if agent is None:
+        agent = Agent()
+    eps_losses = []
+    eps_rewards = []
+    counters = {'steps': 0, 'updates': 0, 'episodes': 0}
+    if checkpoint is not None and os.path.exists(checkpoint):
+        _, eps_losses, eps_rewards = load_checkpoint(checkpoint, agent, counters)
+    pool = RolloutPool(agent, n_workers, envs_per_worker, rollout_length, seed=random.randrange(2**31 - n_workers))
+    pool.start()
+    #With n-step returns, the transitions of every worker go through their own accumulator, one time step at a time
+    n_step_buffers = [VecNStepBuffer(agent.n_step, agent.gamma, envs_per_worker, agent.obs_spec.size)
+                      for _ in range(n_workers)] if agent.n_step > 1 else None
+
+    steps = counters['steps']
+    updates = counters['updates']
+    episodes = counters['episodes']
+    losses = []
+    try:
+        while steps < total_steps:
+            k, rollout = pool.get_rollout()
+            states, actions, rewards, next_states, dones, episode_rewards = (a.reshape(-1, *a.shape[2:]) for a in rollout)
+            #One time step at a time, so the memory sees every game in the same row and can de-duplicate its states
+            for t in range(rollout_length):
+                step = tuple(a[t] for a in rollout[:5])
+                agent.memory.add_batch(*(step if n_step_buffers is None else n_step_buffers[k].add(*step)))
+            steps += len(states)
+
+            for _ in range(updates_per_rollout):
+                loss = agent.replay()
+                if loss is not None:
+                    losses.append(loss)
+                    updates += 1
+                    if updates % publish_every == 0:
+                        pool.publish_weights()
+
+            for episode_reward in episode_rewards[dones]:
+                episode_loss = np.nan
+                if losses:
+                    episode_loss = np.mean(losses)
+                    losses = []
+                if keep_history:
+                    eps_rewards.append(float(episode_reward))
+                    if not np.isnan(episode_loss):
+                        eps_losses.append(episode_loss)
+                if log is not None:
+                    log.append(episodes, reward=episode_reward, loss=episode_loss, epsilon=agent.eps)
+                episodes += 1
+                agent.decay_epsilon() #Decay eps after every episode, whichever worker played it
+            pool.set_epsilon(agent.eps)
+
+            finished = int(dones.sum())
+            if checkpoint is not None and episodes // checkpoint_every > (episodes - finished) // checkpoint_every:
+                with pool.paused():
+                    save_checkpoint(checkpoint, agent, episodes - 1, eps_losses, eps_rewards,
+                                    counters={'steps': steps, 'updates': updates, 'episodes': episodes})
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, agent, episodes - 1, eps_losses, eps_rewards,
+                            counters={'steps': steps, 'updates': updates, 'episodes': episodes})
+    finally:
+        pool.close()
+
+    return eps_losses, eps_rewards
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Train the agent without a display.')
+    parser.add_argument('--workers', type=int, default=0, help='Number of rollout worker processes, 0 trains in a single process.')
+    parser.add_argument('--episodes', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=1_000_000, help='Environment steps to collect when using workers.')
+    parser.add_argument('--enemies', type=int, default=MAX_ENEMIES, help='Enemy cap, raise it for high-density variants.')
+    parser.add_argument('--grid', action='store_true', help='Use the spatial hash for collision and closest enemy queries '
+                        '(slower than the plain loop for now, check game.step).')
+    parser.add_argument('--action-repeat', type=int, default=1, help='Frames each action is held for, the agent decides once per action.')
+    parser.add_argument('--coarse', action='store_true', help='Simulate the repeated frames as a single swept step.')
+    parser.add_argument('--checkpoint', help='Checkpoint file, the run resumes from it if it exists.')
+    parser.add_argument('--checkpoint-every', type=int, default=50, help='Episodes between two checkpoints.')
+    parser.add_argument('--metrics', help='Time every phase of the loop and append the metrics to this .jsonl or .csv file.')
+    parser.add_argument('--prioritized', action='store_true', help='Use prioritized experience replay.')
+    parser.add_argument('--memory-size', type=int, default=100_000, help='Replay memory capacity, in transitions.')
+    parser.add_argument('--replay-dir', help='Keep the replay memory in memory-mapped files in this directory, '
+                                             'for capacities that do not fit in RAM. Reopened if it already exists.')
+    parser.add_argument('--replay-dtype', choices=['float32', 'float16'], default='float32',
+                        help='Precision the observations are stored with in --replay-dir.')
+    parser.add_argument('--replay-flush-every', type=int, default=FLUSH_EVERY,
+                        help='Transitions between two flushes of --replay-dir, which readers and a restart see.')
+    parser.add_argument('--n-step', type=int, default=1, help='Frames summed into every stored reward (n-step returns).')
+    parser.add_argument('--double-dqn', action='store_true', help='Let the q network pick the next action of the targets.')
+    parser.add_argument('--tau', type=float, default=None, help='Soft target updates with this rate, instead of a copy every 100 updates.')
+    parser.add_argument('--train-every', type=int, default=1, help='Environment steps between two training rounds.')
+    parser.add_argument('--gradient-steps', type=int, default=1, help='Gradient updates per training round.')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--background-learner', action='store_true', help='Train on a separate thread so the game loop never waits on backprop.')
+    parser.add_argument('--obs', choices=list(SPECS), default='absolute', help='Observation layout, check observation.py.')
+    parser.add_argument('--log', help='Stream the per-episode metrics to this directory instead of keeping them in memory, '
+                                      'check metrics_log.py to watch it live.')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the run, the same seed replays the same games.')
+    parser.add_argument('--record', help='Append every episode to this recording file, check recording.py.')
+    parser.add_argument('--record-positions', action='store_true', help='Store the positions in the recording too.')
+    parser.add_argument('--render', action='store_true', help='Watch the episodes in a window drawn by another process, '
+                        'frames are dropped when it falls behind.')
+    parser.add_argument('--render-every', type=int, default=5, help='Episodes between two rendered ones.')
+    parser.add_argument('--export-dir', help='Write the rendered episodes to this directory, drawn offscreen. '
+                        'Episodes are skipped whole when the export falls behind.')
+    parser.add_argument('--export-format', choices=['png', 'mp4'], default='png',
+                        help='PNG sequence per episode, or one video per episode (needs ffmpeg).')
+    parser.add_argument('--compile-policy', choices=['trace', 'compile'], default=None, help='Trace or compile the network used for acting.')
+    args = parser.parse_args()
+    if args.workers > 0:
+        #Options of the single-process loop that the workers don't support
+        single_process = ['render', 'export_dir', 'metrics', 'record', 'record_positions', 'enemies', 'grid',
+                          'action_repeat', 'coarse', 'train_every', 'gradient_steps', 'background_learner']
+        unsupported = [name for name in single_process if getattr(args, name) != parser.get_default(name)]
+        if unsupported:
+            parser.error(f"{', '.join('--' + name.replace('_', '-') for name in unsupported)} only work without --workers")
+
+    if args.seed is not None:
+        seed_everything(args.seed)
+    agent = Agent(prioritized=args.prioritized, compile_policy=args.compile_policy, observation=args.obs, seed=args.seed,
+                  n_step=args.n_step, double_dqn=args.double_dqn, tau=args.tau, memory_size=args.memory_size,
+                  replay_dir=args.replay_dir, replay_dtype=args.replay_dtype, batch_size=args.batch_size,
+                  replay_flush_every=args.replay_flush_every)
+    metrics = Metrics(enabled=True, sink=open_sink(args.metrics)) if args.metrics else None
+    recorder = EpisodeRecorder(args.record, args.record_positions) if args.record else None
+    log = MetricsLog(args.log) if args.log else None
+    renderer = None
+    if args.render or args.export_dir:
+        from render import AsyncTrainingRenderer #Only needs pygame when rendering
+        renderer = AsyncTrainingRenderer(display=args.render, export_dir=args.export_dir, export_format=args.export_format)
+    if args.workers > 0:
+        losses, rewards = parallel_training_loop(total_steps=args.steps, n_workers=args.workers, agent=agent,
+                                                 log=log, keep_history=log is None, checkpoint=args.checkpoint,
+                                                 checkpoint_every=args.checkpoint_every)
+    else:
+        losses, rewards = agent_training_loop(n_episodes=args.episodes, render_episode=args.render_every,
+                                              renderer=renderer, agent=agent, train_every=args.train_every,
+                                              gradient_steps=args.gradient_steps, batch_size=args.batch_size,
+                                              background_learner=args.background_learner, n_enemies=args.enemies,
+                                              use_grid=args.grid, action_repeat=args.action_repeat, coarse_steps=args.coarse,
+                                              checkpoint=args.checkpoint, checkpoint_every=args.checkpoint_every,
+                                              metrics=metrics, seed=args.seed, recorder=recorder,
+                                              log=log, keep_history=log is None)
+    if renderer is not None:
+        renderer.close()
+        if renderer.dropped:
+            print(f"Showed {renderer.sent} frames, dropped {renderer.dropped} while the window was behind")
+        if renderer.skipped_episodes:
+            print(f"Exported {len(renderer.exported_episodes)} episodes, skipped {len(renderer.skipped_episodes)} while "
+                  f"the exporter was behind (listed in {args.export_dir}/skipped_episodes.txt)")
+    if metrics is not None:
+        metrics.close()
+    if args.replay_dir:
+        agent.memory.close()
+    if recorder is not None:
+        recorder.close()
+    if log is not None:
+        log.close()
+    if rewards:
+        print(f"Trained {len(rewards)} episodes, last reward: {rewards[-1]:.2f}")
+    else:
+        print(f"Training done, the metrics are in {args.log}")
@@ -0,0 +1,209 @@
+import numpy as np
+import game
+from game import SCREEN_WIDTH, SCREEN_HEIGHT, ENEMY_SPD, SPAWN_FRAMES
+from observation import get_spec, encode_ego_batch
+
+'''
+Vectorized version of the environment in game.py, running N games at once.
+Every game is stored in structure-of-arrays NumPy buffers, so a single step() call moves, collides and
+rewards all the games with a handful of array operations instead of looping over Enemy objects.
+'''
+
+PLAYER_SIZE = 60
+PLAYER_SPD = 15
+ENEMY_SIZE = 20
+
+#Same action order as game.step: left, right, up, down and the diagonals (x, y)
+ACTION_DELTAS = np.array([[-1, 0], [1, 0], [0, -1], [0, 1], [-1, -1], [-1, 1], [1, 1], [1, -1]], dtype=np.float64)
+
+
+def _overlap(ax, ay, aw, ah, bx, by, bw, bh):
+    '''
+    Vectorized pygame.Rect.colliderect, touching edges do not count.
+    '''
+    return (ax < bx + bw) & (ay < by + bh) & (ax + aw > bx) & (ay + ah > by)
+
+
+class VecEnv:
+    '''
+    N independent games stepped together. Finished games are reset automatically.
+    observation is the name of the layout in observation.SPECS.
+    With max_steps, games lasting that long are ended too (truncated) so a good policy can't play forever.
+    '''
+    def __init__(self, n_envs, n_enemies = 20, seed = None, observation = 'absolute', max_steps = None):
+        self.n_envs = n_envs
+        self.max_steps = max_steps
+        self.n_enemies = n_enemies
+        self.obs_spec = get_spec(observation)
+        self.ego = self.obs_spec.name == 'ego'
+        self.obs_size = self.obs_spec.size if self.ego else 2 + 2 * n_enemies
+        self.rng = np.random.default_rng(seed)
+
+        #Player
+        self.player_pos = np.empty((n_envs, 2), dtype=np.float64)
+        self.player_rect = np.empty((n_envs, 2), dtype=np.int64) #Top-left corner, size is PLAYER_SIZE
+        self.hp = np.empty(n_envs, dtype=np.int64)
+
+        #Enemies, kept compacted at the front of each row in spawn order, like game.EnemyPool
+        self.enemy_pos = np.zeros((n_envs, n_enemies, 2), dtype=np.float64)
+        self.enemy_dir = np.zeros((n_envs, n_enemies, 2), dtype=np.float64)
+        self.enemy_rect = np.zeros((n_envs, n_enemies, 2), dtype=np.int64)
+        self.alive = np.zeros((n_envs, n_enemies), dtype=bool)
+        self.frames_passed = np.zeros(n_envs, dtype=np.int64)
+
+        self.episode_reward = np.zeros(n_envs, dtype=np.float64)
+        self.episode_length = np.zeros(n_envs, dtype=np.int64)
+        self.episode_hits = np.zeros(n_envs, dtype=np.int64)
+        self.episode_border_frames = np.zeros(n_envs, dtype=np.int64) #Frames spent touching a border
+        #Stats of the last finished episode of every game
+        self.last_episode_reward = np.zeros(n_envs, dtype=np.float64)
+        self.last_episode_length = np.zeros(n_envs, dtype=np.int64)
+        self.last_episode_hits = np.zeros(n_envs, dtype=np.int64)
+        self.last_episode_border_frames = np.zeros(n_envs, dtype=np.int64)
+        self.truncated = np.zeros(n_envs, dtype=bool) #Which of the games that finished in the last step were truncated
+
+        self._rows = np.arange(n_envs)
+        self._obs = np.empty((n_envs, self.obs_size), dtype=np.float32)
+        self._scale = np.array([SCREEN_WIDTH, SCREEN_HEIGHT], dtype=np.float64)
+
+    def reset(self):
+        '''
+        Resets every game and returns the first observations.
+        '''
+        self._reset_envs(np.ones(self.n_envs, dtype=bool))
+        return self._observe(self.alive)
+
+    def _reset_envs(self, mask):
+        self.player_pos[mask] = (SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2)
+        self.player_rect[mask] = (SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2)
+        self.hp[mask] = 1
+        self.alive[mask] = False
+        self.frames_passed[mask] = 0
+        self.episode_reward[mask] = 0.0
+        self.episode_length[mask] = 0
+        self.episode_hits[mask] = 0
+        self.episode_border_frames[mask] = 0
+
+    def _spawn(self):
+        '''
+        Spawns one enemy in every game that waited more than SPAWN_FRAMES frames and has room for it.
+        '''
+        count = self.alive.sum(axis=1)
+        rows = np.nonzero((count < self.n_enemies) & (self.frames_passed > SPAWN_FRAMES))[0]
+        if rows.size:
+            n = rows.size
+            #Same distribution as Enemy.__init__: pick a vertical or horizontal border, then one of its two sides
+            vertical = self.rng.integers(0, 2, n) == 0
+            far_side = self.rng.integers(0, 2, n) == 1
+            along_x = self.rng.integers(0, SCREEN_WIDTH + 1, n)
+            along_y = self.rng.integers(0, SCREEN_HEIGHT + 1, n)
+            x = np.where(vertical, np.where(far_side, SCREEN_WIDTH, 0), along_x)
+            y = np.where(vertical, along_y, np.where(far_side, SCREEN_HEIGHT, 0))
+
+            slots = count[rows]
+            spawn = np.stack((x, y), axis=1)
+            self.enemy_rect[rows, slots] = spawn
+            self.enemy_pos[rows, slots] = spawn
+            direction = self.player_pos[rows] - spawn
+            self.enemy_dir[rows, slots] = direction / np.linalg.norm(direction, axis=1, keepdims=True)
+            self.alive[rows, slots] = True
+            self.frames_passed[rows] = 0
+
+        self.frames_passed += 1
+
+    def _observe(self, present):
+        obs = self._obs
+        if self.ego:
+            encode_ego_batch(self.player_pos, self.enemy_pos, self.enemy_dir, present, self.obs_spec.k, obs)
+            return obs.copy()
+        obs[:, 0:2] = self.player_pos / self._scale
+        enemies = np.where(present[:, :, None], self.enemy_pos / self._scale, -1.0)
+        obs[:, 2:] = enemies.reshape(self.n_envs, -1)
+        return obs.copy()
+
+    def step(self, actions):
+        '''
+        Steps every game with its action and returns (observations, rewards, dones).
+        Games that finish are reset, so their returned observation is already the first one of the next episode.
+        '''
+        self._spawn()
+
+        #Player movement, same as Player.set_dest followed by Player.move
+        half = PLAYER_SIZE // 2
+        dest = self.player_pos + ACTION_DELTAS[actions] * PLAYER_SPD
+        np.clip(dest[:, 0], half, SCREEN_WIDTH - half, out=dest[:, 0])
+        np.clip(dest[:, 1], half, SCREEN_HEIGHT - half, out=dest[:, 1])
+        vect = dest - self.player_pos
+        length = np.linalg.norm(vect, axis=1)
+        arrived = length < PLAYER_SPD
+        scale = np.divide(PLAYER_SPD, length, out=np.zeros_like(length), where=~arrived)
+        self.player_pos = np.where(arrived[:, None], dest, self.player_pos + vect * scale[:, None])
+        self.player_rect = self.player_pos.astype(np.int64) - half
+
+        #Centering reward
+        center = self._scale / 2
+        dist_from_center = np.linalg.norm(self.player_pos - center, axis=1)
+        rewards = 1.0 - dist_from_center / np.linalg.norm(center)
+
+        #Border penalty
+        px = self.player_rect[:, 0]
+        py = self.player_rect[:, 1]
+        on_edge = (_overlap(px, py, PLAYER_SIZE, PLAYER_SIZE, 0, 0, SCREEN_WIDTH, 1) |
+                   _overlap(px, py, PLAYER_SIZE, PLAYER_SIZE, 0, SCREEN_HEIGHT, SCREEN_WIDTH, 1) |
+                   _overlap(px, py, PLAYER_SIZE, PLAYER_SIZE, 0, 0, 1, SCREEN_HEIGHT) |
+                   _overlap(px, py, PLAYER_SIZE, PLAYER_SIZE, SCREEN_WIDTH, 0, 1, SCREEN_HEIGHT))
+        rewards -= game.BORDER_PENALTY * on_edge #Read from game on every step, sweep.py changes them
+
+        #Collisions against the enemy rects from the previous frame, the enemies that did not hit anything move
+        present = self.alive.copy()
+        ex = self.enemy_rect[:, :, 0]
+        ey = self.enemy_rect[:, :, 1]
+        hit = present & _overlap(px[:, None], py[:, None], PLAYER_SIZE, PLAYER_SIZE, ex, ey, ENEMY_SIZE, ENEMY_SIZE)
+        moving = present & ~hit
+        self.enemy_pos += self.enemy_dir * (ENEMY_SPD * moving[:, :, None])
+        self.enemy_rect = np.where(moving[:, :, None], self.enemy_pos.astype(np.int64) - ENEMY_SIZE // 2, self.enemy_rect)
+        ex = self.enemy_rect[:, :, 0]
+        ey = self.enemy_rect[:, :, 1]
+        off_screen = moving & ~_overlap(ex, ey, ENEMY_SIZE, ENEMY_SIZE, 0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+        n_hits = hit.sum(axis=1)
+        self.hp -= n_hits
+        rewards -= game.HIT_PENALTY * n_hits
+        dones = self.hp <= 0
+        self.alive = present & ~hit & ~off_screen
+
+        #The closer the enemy gets, lesser the reward received
+        dist = np.linalg.norm(self.enemy_pos - self.player_pos[:, None, :], axis=2)
+        closest = np.where(present, dist, np.inf).min(axis=1)
+        rewards += np.where(self.alive.any(axis=1), game.DISTANCE_REWARD * closest, 0.0)
+
+        #Like game.step, the absolute observation still lists the enemies removed this step, the ego one doesn't
+        obs = self._observe(self.alive if self.ego else present)
+
+        #Keep the surviving enemies compacted at the front, in spawn order
+        if not np.array_equal(self.alive, present):
+            order = np.argsort(~self.alive, axis=1, kind='stable')
+            self.alive = np.take_along_axis(self.alive, order, axis=1)
+            self.enemy_pos = np.take_along_axis(self.enemy_pos, order[:, :, None], axis=1)
+            self.enemy_dir = np.take_along_axis(self.enemy_dir, order[:, :, None], axis=1)
+            self.enemy_rect = np.take_along_axis(self.enemy_rect, order[:, :, None], axis=1)
+
+        self.episode_reward += rewards
+        self.episode_length += 1
+        self.episode_hits += n_hits
+        self.episode_border_frames += on_edge
+
+        if self.max_steps is not None:
+            self.truncated = ~dones & (self.episode_length >= self.max_steps)
+            dones = dones | self.truncated
+
+        if dones.any():
+            self.last_episode_reward[dones] = self.episode_reward[dones]
+            self.last_episode_length[dones] = self.episode_length[dones]
+            self.last_episode_hits[dones] = self.episode_hits[dones]
+            self.last_episode_border_frames[dones] = self.episode_border_frames[dones]
+            self._reset_envs(dones)
+            obs[dones, 0:2] = self.player_pos[dones] / self._scale
+            obs[dones, 2:] = 0.0 if self.ego else -1.0
+
+        return obs, rewards, dones